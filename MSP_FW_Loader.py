@@ -1,6 +1,8 @@
 import subprocess
 import os
 
+from version_cache import version_cache
+
 
 
 class MSP_FW_Loader():
@@ -27,6 +29,8 @@ class MSP_FW_Loader():
        #else:
        #     raise Exception("error with MSP FW load!")
        
+       # The implant versions change with the firmware, even if flashing fails part way.
+       version_cache.invalidate()
        subprocess.run(["MSP430Flasher.exe", '-w', firmwareFile, "-v", "-g", "-z", "[VCC]"])
     
 
@@ -1,12 +1,16 @@
 import subprocess
 import os
 
+from version_cache import version_cache
+
 class Nordic_FW_Loader():
     
     def programNordic(self, NordicFWFolder,serialNumber = "683772875"):
 
         "C:\\Users\\charles.fawole\\Box Sync\\RF IPG\M1100 Firmware Builds\\"+NordicFWFolder+"\\"
         os.chdir(NordicFWFolder)
+        # The implant versions change with the firmware, even if flashing fails part way.
+        version_cache.invalidate()
         subprocess.run(["nrfjprog","-s",serialNumber,"-e"])
         subprocess.run(["nrfjprog","-s",serialNumber,"--program", "softdevice.hex"])
         subprocess.run(["nrfjprog","-s",serialNumber,"--program", "arm_bootloader.hex"])
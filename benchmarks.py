@@ -0,0 +1,288 @@
+#!/usr/bin/python3
+"""
+Description: Benchmarks for the bluetooth connectivity test tooling.
+
+Every benchmark runs offline: the monitor driver talks to a simulated serial port and the test
+cycle uses the simulated drivers. Startup benchmarks run in a fresh interpreter so that the
+measured import cost is not hidden by modules already loaded in this process.
+
+Results are reported in seconds per operation. They can be saved as a JSON baseline and later
+runs compared against it; a benchmark slower than the baseline by more than the threshold fails
+the run.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# Modules that must not be imported by simply loading the test or doing a dry run.
+HEAVY_MODULES = ['clr', 'serial', 'recordclass', 'numpy', 'sentiva_wand', 'sentiva_monitor',
+                 'FW_From_SVN', 'MSP_FW_Loader', 'Nordic_FW_Loader']
+
+STARTUP_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+heavy = [m for m in {heavy!r} if m in sys.modules]
+print(json.dumps([elapsed, heavy]))
+"""
+
+STARTUP_CASES = [
+    ('import_test', 'import bluetooth_rf_connectivity_test'),
+    ('construct_test', 'import bluetooth_rf_connectivity_test as t; t.BluetoothConnectivityTest()'),
+    ('dry_run', 'import run_bluetooth_rf_connectivity_test as r; r.main(["--dry-run"])'),
+]
+
+DEFAULT_BASELINE = 'benchmark_baseline.json'
+
+
+def _run_startup_probe(statement):
+    """ Time a statement in a fresh interpreter.
+
+    Returns:
+        A tuple of (seconds spent in the statement, heavy modules it imported).
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    probe = STARTUP_PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    out = subprocess.run([sys.executable, '-c', probe], cwd=here, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    return tuple(json.loads(out.strip().splitlines()[-1]))
+
+
+def bench_startup(repeat=5):
+    """ Measure import and construction cost of the test and the runner's dry run.
+
+    Args:
+        repeat: The number of fresh interpreters to run per case. The best time is reported.
+
+    Returns:
+        A dict of case name to {'seconds': best time, 'heavy_modules': modules imported}.
+    """
+    results = {}
+    for name, statement in STARTUP_CASES:
+        timings = []
+        heavy = []
+        for _ in range(repeat):
+            (elapsed, heavy) = _run_startup_probe(statement)
+            timings.append(elapsed)
+        results[name] = {'seconds': min(timings), 'heavy_modules': heavy}
+    return results
+
+
+def _time_per_op(operation, number, repeat):
+    """ The best of `repeat` runs of `number` calls to operation, in seconds per call. """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            operation()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+@contextlib.contextmanager
+def _simulated_monitor(device_names=None, chunk_interval=0.0):
+    """ The real monitor driver on a simulated serial port, with no command wait.
+
+    The monitor is shut down afterwards so its reader thread does not skew later benchmarks.
+    """
+    from sentiva_monitor import SentivaMonitor
+    from simulated_drivers import SimulatedSerialPort
+
+    monitor = SentivaMonitor('simulated', port=SimulatedSerialPort(device_names,
+                                                                   chunk_interval=chunk_interval))
+    monitor.command_timeout = 0
+    try:
+        yield monitor
+    finally:
+        monitor.shutdown()
+
+
+def bench_execute_command(repeat):
+    """ Round-trip overhead of SentivaMonitor._execute_command. """
+    with _simulated_monitor() as monitor:
+        return _time_per_op(lambda: monitor._execute_command('version'), 2000, repeat)
+
+
+def bench_ble_scan(repeat):
+    """ Parse throughput of SentivaMonitor.ble_scan for a list of 1000 devices. """
+    with _simulated_monitor(['Device_{:04d}'.format(index) for index in range(1000)]) as monitor:
+        return _time_per_op(lambda: monitor.ble_scan(0), 20, repeat)
+
+
+def bench_set_scan_params(repeat):
+    """ SentivaMonitor.setScanParams command and response parsing. """
+    with _simulated_monitor() as monitor:
+        return _time_per_op(lambda: monitor.setScanParams(40, 30), 2000, repeat)
+
+
+def bench_ble_connect(repeat):
+    """ SentivaMonitor.ble_connect with its reply arriving in chunks 2 ms apart. """
+    with _simulated_monitor(chunk_interval=0.002) as monitor:
+        monitor.ble_scan(0)
+        return _time_per_op(lambda: monitor.ble_connect('IPG_EA271A', 1), 50, repeat)
+
+
+def _simulated_test(log_path, sink_name='csv'):
+    from bluetooth_rf_connectivity_test import BluetoothConnectivityTest
+    from plugin_registry import registry, PluginRegistry
+
+    test = BluetoothConnectivityTest(monitor_driver='simulated_monitor',
+                                     wand_driver='simulated_wand',
+                                     sinks=[registry.create(PluginRegistry.SINK, sink_name,
+                                                            log_path)])
+    test.SETTLE_DURATION = 0
+    test.JITTER_SCALE = 0
+    # One repetition per cycle, without a sweep checkpoint.
+    test.SWEEP_MIN_REPETITIONS = test.SWEEP_MAX_REPETITIONS = 1
+    test.sweep_checkpoint = None
+    return test
+
+
+def _bench_record_measurement(repeat, sink_name):
+    with tempfile.TemporaryDirectory() as directory:
+        test = _simulated_test(os.path.join(directory, 'results'), sink_name)
+        row = dict(ind=0, Tstamp='2020-01-01 00:00:00.000000', Telapsed=12.5, Nattempt=1,
+                   Bid='C0FFEE000001', Bscan=True, Tscan=1.25, Bconn=True, Tconn=2.5,
+                   AdvInterval=1, ScanInterval=40, ScanWindow=30, IntervalAndWindow='40:30',
+                   svn_rev=1234, fw_build='1.2.3', msp_ver='Model = 10', nordic_ver='0x0004',
+                   error_msg='No errors', avg_rssi=-60.0)
+        seconds = _time_per_op(lambda: test.record_measurement(**row), 2000, repeat)
+        for sink in test.sinks:
+            sink.close()
+    return seconds
+
+
+def bench_record_measurement(repeat):
+    """ BluetoothConnectivityTest.record_measurement write throughput to a local CSV. """
+    return _bench_record_measurement(repeat, 'csv')
+
+
+def bench_record_measurement_columnar(repeat):
+    """ BluetoothConnectivityTest.record_measurement write throughput to columnar results. """
+    return _bench_record_measurement(repeat, 'columnar')
+
+
+def bench_connection_callback(repeat):
+    """ A full connection_callback cycle with the simulated wand and monitor.
+
+    The simulated dev kit fails some connections on purpose; any other exception fails the run.
+    """
+    from exceptions import DevKitConnectionException, CONNECT_FAILED
+
+    unexpected = []
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, 'w') as devnull:
+        test = _simulated_test(os.path.join(directory, 'results.csv'))
+
+        def cycle():
+            try:
+                test.connection_callback('0', '0', '')
+            except DevKitConnectionException as e:
+                if e.code != CONNECT_FAILED:
+                    unexpected.append(e)
+            except Exception as e:
+                unexpected.append(e)
+
+        try:
+            with contextlib.redirect_stdout(devnull):
+                seconds = _time_per_op(cycle, 200, repeat)
+        finally:
+            for sink in test.sinks:
+                sink.close()
+
+    if unexpected:
+        raise RuntimeError('connection_callback failed unexpectedly {} times, first: {!r}'.format(
+            len(unexpected), unexpected[0]))
+    return seconds
+
+
+BENCHMARKS = [
+    ('execute_command', bench_execute_command),
+    ('ble_scan_1000_devices', bench_ble_scan),
+    ('set_scan_params', bench_set_scan_params),
+    ('ble_connect_chunked', bench_ble_connect),
+    ('record_measurement', bench_record_measurement),
+    ('record_measurement_columnar', bench_record_measurement_columnar),
+    ('connection_callback', bench_connection_callback),
+]
+
+
+def run_benchmarks(repeat=5, startup=True):
+    """ Run every benchmark.
+
+    Returns:
+        A tuple of (dict of benchmark name to seconds per operation, list of startup problems).
+    """
+    results = {}
+    problems = []
+
+    for name, benchmark in BENCHMARKS:
+        results[name] = benchmark(repeat)
+
+    if startup:
+        for name, result in bench_startup(repeat).items():
+            results['startup_' + name] = result['seconds']
+            if result['heavy_modules']:
+                problems.append('{} imports {}'.format(name, ', '.join(result['heavy_modules'])))
+
+    return (results, problems)
+
+
+def compare(results, baseline, threshold):
+    """ Find benchmarks slower than their baseline by more than the threshold.
+
+    Args:
+        results: Benchmark name to seconds per operation.
+        baseline: Benchmark name to baseline seconds per operation.
+        threshold: The allowed slowdown as a fraction, e.g. 0.25 for 25%.
+
+    Returns:
+        A list of regression descriptions.
+    """
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        reference = baseline.get(name)
+        if reference and seconds > reference * (1 + threshold):
+            regressions.append('{} is {:.0%} slower than its baseline'.format(
+                name, seconds / reference - 1))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Offline benchmarks for the connectivity test')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per benchmark, best is kept')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help='JSON baseline file')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown against the baseline, as a fraction')
+    parser.add_argument('--no-startup', action='store_true', help='Skip the startup benchmarks')
+    args = parser.parse_args(argv)
+
+    (results, problems) = run_benchmarks(args.repeat, startup=not args.no_startup)
+    for name, seconds in results.items():
+        print('{:<28} {:12.3f} us/op'.format(name, seconds * 1e6))
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print('Baseline saved to {}'.format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            problems += compare(results, json.load(baseline_file), args.threshold)
+
+    for problem in problems:
+        print('REGRESSION: ' + problem)
+
+    return 1 if problems else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
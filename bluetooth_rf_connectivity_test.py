@@ -5,16 +5,22 @@ Author: Cove Technology, Ryan Summers
 Description: A hardware test to exercise bluetooth connectivity of the Sentiva 2.0 device.
 """
 
-import time,datetime,random
+import os,time,datetime,random
 
 
-from  sentiva_monitor import SentivaMonitor
-from sentiva_wand import SentivaWand
+from plugin_registry import registry, PluginRegistry
+from multi_target import MultiTargetScan
+from task_graph import TaskGraph
+from timing import elapsed_seconds
+from version_cache import version_cache
+from sweep_engine import SequentialSweep
+from failure_policy import RecoveryPolicy, REBOOT_MONITOR, REHANDSHAKE_WAND
 
 #from autotest.framework.hardware_test import HardwareTest
 #from autotest.framework.rules import ConstantValueRule, MinimumValueRule
 
 from exceptions import ResourceNotFound, AutoTestException,WandCommException,DevKitConnectionException
+from exceptions import DEVICE_NOT_FOUND, CONNECT_FAILED, RSSI_FAILED
 
 
 
@@ -32,30 +38,123 @@ class BluetoothConnectivityTest():
     WORST_RSSI = -150.0
 
     EXPECTED_BLUETOOTH_NAME = "IPG_EA271A"
+    IPG_SERIAL_NUMBER = 15345434  # Set on the implant through the wand before each sweep
     MIN_EXPECTED_RSSI = -85.0
     SCAN_DURATION = 1
     NUM_RSSI_SAMPLES = 10
     MAX_SCAN_ATTEMPTS = 600  # 10 minutes timeout for scan and connect
     ADV_INTERVAL = 1
+    SETTLE_DURATION = 1.0  # Pause before the monitor reset
+    JITTER_SCALE = 1.0  # Random pauses before scanning and connecting, in advertising intervals
 
+    # Implants looked for by the multi-target test.
+    EXPECTED_BLUETOOTH_NAMES = [EXPECTED_BLUETOOTH_NAME]
 
-    logFile = open("RSSILog_root_cause_test_svn_fw5.csv","w+")
-    logFileRemote = open("C:\\Users\\charles.fawole\\Box Sync\\RF IPG\\M1100 Jenkins\\Test Plan for BLE Discovery\\svn_fw5.csv","w+")
-    #logFile.write('Index,TimeStamp, Test Time Total (s), Number of Attempts, BLE Name, ScanSucess, Scan Latency(s), ConnectionSuccess, Connection Latency (s), advertising interval (s), scanInterval (ms), scanWindow (ms), IntervalAndWindow(ms:ms) \n')
-    #logFileRemote.write('Index,TimeStamp, Test Time Total (s), Number of Attempts, BLE Name, ScanSucess, Scan Latency(s), ConnectionSuccess, Connection Latency (s), advertising interval (s), scanInterval (ms), scanWindow (ms), IntervalAndWindow(ms:ms) \n')
-		
-    
-    
+    SCAN_INTERVALS = [40]  # ms
+    SCAN_WINDOWS = [30]  # ms
 
-    def __init__(self):
+    # Bounds on the repetitions of each sweep combination, the 95% interval half widths at which
+    # a combination stops (success rate, and mean scan latency relative to the mean), and where an
+    # unfinished sweep is saved. A pass costs more than the former single repetition per
+    # combination: 3 repetitions for a combination that always connects at a steady scan latency,
+    # about 4.4 on average (3 to 7) for one connecting 80% of the time, about 7 for one connecting
+    # half the time and at most SWEEP_MAX_REPETITIONS (see sweep_engine.self_check). Scan latency
+    # only resolves to a scan attempt, hence the loose latency target. Set both bounds to 1 to run
+    # one repetition per combination as before, without early stopping.
+    SWEEP_MIN_REPETITIONS = 2
+    SWEEP_MAX_REPETITIONS = 10
+    SWEEP_SUCCESS_HALF_WIDTH = 0.3
+    SWEEP_LATENCY_HALF_WIDTH = 0.5
+    SWEEP_CHECKPOINT = "sweep_checkpoint.json"
+
+    MONITOR_PORT = 'COM8'
+    MONITOR_SERIAL_NUMBER = '000683808454'
+    # (port, serial number) of every dev kit. The first is the scanning/single target monitor.
+    MONITOR_PORTS = [(MONITOR_PORT, MONITOR_SERIAL_NUMBER)]
+
+    # Results are appended to rotating local segments that are compressed and shipped to the
+    # remote (Box Sync) directory in the background.
+    LOG_NAME = "RSSILog_root_cause_test_svn_fw5"
+    LOG_DIRECTORY = "logs"
+    REMOTE_LOG_DIRECTORY = "C:\\Users\\charles.fawole\\Box Sync\\RF IPG\\M1100 Jenkins\\Test Plan for BLE Discovery"
+    # Each run is also stored in the columnar binary format under this directory.
+    RESULTS_DIRECTORY = "results"
+    #Header: 'Index,TimeStamp, Test Time Total (s), Number of Attempts, BLE Name, ScanSucess, Scan Latency(s), ConnectionSuccess, Connection Latency (s), advertising interval (s), scanInterval (ms), scanWindow (ms), IntervalAndWindow(ms:ms) \n'
+
+
+    def __init__(self, monitor_driver='sentiva_monitor', wand_driver='sentiva_wand', sinks=None,
+                 monitor_ports=None):
+        """ Initialize the test. Drivers are looked up in the plugin registry and are not
+            imported or opened until first used.
+
+        Args:
+            monitor_driver: The registered name of the implant monitor driver.
+            wand_driver: The registered name of the wand driver.
+            sinks: The result sinks rows are written to. Defaults to the shipped CSV log and
+                the columnar results.
+            monitor_ports: (port, serial number) of every dev kit. Defaults to MONITOR_PORTS.
+        """
+        self.monitor_driver = monitor_driver
+        self.wand_driver = wand_driver
+        self.monitor_ports = list(monitor_ports or self.__class__.MONITOR_PORTS)
+        self._implant_monitors = [None] * len(self.monitor_ports)
+        self._wand = None
+
+        # The firmware loaders change the working directory before the first row is written,
+        # so the local paths are resolved against the directory the test was started from.
+        self.log_directory = os.path.abspath(self.__class__.LOG_DIRECTORY)
+        self.results_directory = os.path.abspath(self.__class__.RESULTS_DIRECTORY)
+        self.sweep_checkpoint = os.path.abspath(self.__class__.SWEEP_CHECKPOINT)
+
+        if sinks is None:
+            sinks = [registry.create(PluginRegistry.SINK, 'shipped_csv',
+                                     self.log_directory, self.__class__.LOG_NAME,
+                                     self.__class__.REMOTE_LOG_DIRECTORY),
+                     registry.create(PluginRegistry.SINK, 'columnar', self.results_directory)]
+        self.sinks = sinks
 
-        self.implant_monitor = SentivaMonitor('COM8','000683808454',None)
-        self.wand = SentivaWand()
-                
         self.connection_attempt_number = 0
         self.connection_holdoff_duration = 0
-  
-    def record_measurement(self,ind='0',Tstamp=datetime.datetime.now(),
+
+        # Chooses how the runner recovers from a failed test iteration.
+        self.recovery_policy = RecoveryPolicy()
+
+        # Called with (phase name, seconds) as each phase of a test iteration ends.
+        self.phase_listener = None
+        self._phase_start = time.perf_counter()
+
+
+    def _get_monitor(self, index):
+        """ Open (on first use) and return the dev kit at an index of the monitor ports. """
+        if self._implant_monitors[index] is None:
+            (port, serial_number) = self.monitor_ports[index]
+            self._implant_monitors[index] = registry.create(PluginRegistry.MONITOR,
+                                                            self.monitor_driver,
+                                                            port, serial_number, None)
+        return self._implant_monitors[index]
+
+
+    @property
+    def implant_monitor(self):
+        """ The scanning implant monitor, opened on first use. """
+        return self._get_monitor(0)
+
+
+    @property
+    def implant_monitors(self):
+        """ Every dev kit, opened on first use. """
+        return [self._get_monitor(index) for index in range(len(self.monitor_ports))]
+
+
+    @property
+    def wand(self):
+        """ The wand, opened on first use. """
+        if self._wand is None:
+            self._wand = registry.create(PluginRegistry.WAND, self.wand_driver)
+        return self._wand
+
+
+    def record_measurement(self,ind='0',Tstamp='0',
                             Telapsed='0',
                             Nattempt='0',
                             Bid='0',
@@ -65,7 +164,7 @@ class BluetoothConnectivityTest():
                             Tconn='0',
                             AdvInterval='0',
                             ScanInterval='0',
-                            ScanWindow ='0',                            
+                            ScanWindow ='0',
                             IntervalAndWindow='0:0',
                             svn_rev = '0',
                             fw_build = '0',
@@ -74,11 +173,91 @@ class BluetoothConnectivityTest():
                             error_msg=' No err',
                             avg_rssi='0',
                             ):
-        
-        self.logFile.write(ind+Tstamp+Telapsed+Nattempt+Bid+Bscan+Tscan+Bconn+Tconn+AdvInterval+ScanInterval+ScanWindow+IntervalAndWindow+svn_rev+fw_build+msp_ver+nordic_ver+error_msg+avg_rssi+'\n'  )
-        self.logFile.flush()
-        self.logFileRemote.write(ind+Tstamp+Telapsed+Nattempt+Bid+Bscan+Tscan+Bconn+Tconn+AdvInterval+ScanInterval+ScanWindow+IntervalAndWindow+svn_rev+fw_build+msp_ver+nordic_ver+error_msg+avg_rssi+'\n'  )
-        self.logFileRemote.flush()
+
+        row = [ind, Tstamp, Telapsed, Nattempt, Bid, Bscan, Tscan, Bconn, Tconn, AdvInterval,
+               ScanInterval, ScanWindow, IntervalAndWindow, svn_rev, fw_build, msp_ver,
+               nordic_ver, error_msg, avg_rssi]
+        for sink in self.sinks:
+            sink.write_row(row)
+
+
+    def _end_phase(self, name):
+        """ Report the time since the previous phase ended to the phase listener.
+
+        Args:
+            name: The phase that just ended. None only restarts the phase clock.
+        """
+        now = time.perf_counter()
+        if name is not None and self.phase_listener is not None:
+            self.phase_listener(name, now - self._phase_start)
+        self._phase_start = now
+
+    def _query_wand(self, fw_build):
+        """ Query the implant versions through the wand. The versions only change when a new
+            build is flashed, so they are queried once per build and then taken from the cache.
+
+        Args:
+            fw_build: The firmware build loaded on the implant.
+
+        Returns:
+            A tuple of the MSP and Nordic version responses.
+        """
+        self.wand.enable()
+
+        versions = version_cache.get(self.__class__.IPG_SERIAL_NUMBER, fw_build)
+        if versions is not None:
+            return versions
+
+        (_, version) = self.wand.get_ipg_version()
+
+        print('IPG Version: {}'.format(version))
+
+        v_msp = self.wand._execute_command('v')
+        v_nordic = self.wand._execute_command('readx 13 4 2')
+        version_cache.put(self.__class__.IPG_SERIAL_NUMBER, fw_build, (v_msp, v_nordic))
+        return (v_msp, v_nordic)
+
+
+    def _setup_monitor(self, scanInterval, scanWindow):
+        """ Reset the monitor and configure its scan parameters.
+
+        Returns:
+            The scan interval and window set on the dev kit, in ms.
+        """
+        time.sleep(self.SETTLE_DURATION)
+
+        #Reset the monitor at the beginning of each test
+        self.implant_monitor.reset()
+        return self.implant_monitor.setScanParams(scanInterval,scanWindow)
+
+
+    def recover(self, exception):
+        """ Classify a failure and apply the recovery the policy picks for it.
+
+        Reflashing is left to the caller, which owns the firmware loaders, as is aborting.
+
+        Returns:
+            The Recovery chosen by the recovery policy.
+        """
+        recovery = self.recovery_policy.choose(exception)
+        print('{} failure ({}), recovery: {}'.format(recovery.failure_class, exception,
+                                                    recovery.action))
+        time.sleep(recovery.delay)
+
+        try:
+            if recovery.action == REBOOT_MONITOR:
+                for monitor in self._implant_monitors:
+                    if monitor is not None:
+                        monitor.reset()
+            elif recovery.action == REHANDSHAKE_WAND:
+                # The next iteration enables the wand and the implant bluetooth again.
+                self.wand.disable()
+        except Exception as e:
+            print('Recovery {} failed: {}'.format(recovery.action, e))
+
+        return recovery
+
+
     def connection_callback(self, svn_n,fw_build,error_msg):
         
         
@@ -89,229 +268,316 @@ class BluetoothConnectivityTest():
         advIntervalStep = 1
         maxAdvInterval = 5
         
-        Nrep = 1
-        
         
         #scanIntervals = range(minScanParam,maxScanInterval+scanParamStep,scanParamStep)    # scan intervals
-        scanIntervals = [40] #range(minScanParam,maxScanInterval,scanParamStep)    # scan intervals
+        scanIntervals = self.__class__.SCAN_INTERVALS #range(minScanParam,maxScanInterval,scanParamStep)    # scan intervals
         advIntervals = [1]#[500,1500,2500,3500,4500]#[760.0,546.25,417.5,318.75,211.25,152.5,20]# [1285.0,1022.5,852.5, range(minAdvInterval,maxAdvInterval+advIntervalStep,advIntervalStep)          # advertising intervals
         #advIntervals = [a/1000.0 for a in advIntervals]        
 
-        reps = range(Nrep)   # number of times to repeat each combination of factors
-        
         v_msp = '0'
         v_nordic = '0'
         
         
         
-        for scanInterval in scanIntervals:
-            scanWindows = [30]#range(10,scanInterval+scanParamStep,scanParamStep)
-            for scanWindow in scanWindows:
-                for advInterval in advIntervals:
-                    
-                    
-                    
-                    
-                    try:
-                        self.wand.enable()
-                        print (self.wand._execute_command('setserial(15345434)'))
-                        self.wand.enable_device_bluetooth(advInterval) # turn on bluetooth at set advertising interval to 1 seconds
-                        #print("about to set millisec inter")
-                        #self.wand.set_InMilliSecondInterval(advInterval)
-                    except Exception:
-                        time.sleep(2)
-                        self.wand.enable()
-                        self.wand._execute_command('setserial(15345434)')
-                        self.wand.enable_device_bluetooth(advInterval) # turn on bluetooth at set advertising interval
-                        #print("about to set millisec inter")
-                        #self.wand.set_InMilliSecondInterval(advInterval)
-                        
-                    
-                    for index in reps:
-                        exception_msg = error_msg
-                        test_time=0
-                        implant_bluetooth_id=" "
-                        implant_detected = " "
-                        scan_duration_seconds = 0 
-                        implant_connected = " "
-                        connection_duration_seconds = 0
-                        setScanParams = [0,0]
-                        advInterval = 0
-                        v_msp ='0' 
-                        v_nordic='0'
-                        rssi = self.__class__.WORST_RSSI
-                         
-                        
-                        
-                        test_time_start = time.time()
-                        try:
-                            print('Run Number {}'.format(index))
-                            print('Advertising Interval {}'.format(advInterval))
-                            print('Scan Interval {}'.format(scanInterval))
-                            print('Scan Window {}'.format(scanWindow))
-                            
-                            
-                            
-                            time.sleep(random.random()*advInterval)  # muddle things up, make things less deterministic by begining to scan a random time after
-                        
+        combinations = [(scanInterval, scanWindow, advInterval)
+                        for scanInterval in scanIntervals
+                        for scanWindow in self.__class__.SCAN_WINDOWS #range(10,scanInterval+scanParamStep,scanParamStep)
+                        for advInterval in advIntervals]
+
+        # Repetitions go to the combination with the least precise success rate and scan
+        # latency until all are precise enough. An interrupted sweep resumes from its checkpoint.
+        sweep = SequentialSweep(combinations,
+                                min_repetitions=self.SWEEP_MIN_REPETITIONS,
+                                max_repetitions=self.SWEEP_MAX_REPETITIONS,
+                                success_half_width=self.SWEEP_SUCCESS_HALF_WIDTH,
+                                latency_relative_half_width=self.SWEEP_LATENCY_HALF_WIDTH,
+                                checkpoint_path=self.sweep_checkpoint,
+                                label='{}:{}'.format(svn_n, fw_build))
+
+        advertising_interval = None
+        while True:
+            combination = sweep.next_combination()
+            if combination is None:
+                break
+            (scanInterval, scanWindow, advInterval) = combination
+            index = sweep.repetitions(combination)
+
+            # A wand failure here is recovered by the runner, and the next call resumes the sweep.
+            if advInterval != advertising_interval:
+                self.wand.enable()
+                print (self.wand._execute_command(
+                    'setserial({})'.format(self.__class__.IPG_SERIAL_NUMBER)))
+                self.wand.enable_device_bluetooth(advInterval) # turn on bluetooth at set advertising interval to 1 seconds
+                #print("about to set millisec inter")
+                #self.wand.set_InMilliSecondInterval(advInterval)
+                advertising_interval = advInterval
+
+            exception_msg = error_msg
+            test_time=0
+            implant_bluetooth_id=" "
+            implant_detected = " "
+            scan_duration_seconds = 0 
+            implant_connected = " "
+            connection_duration_seconds = 0
+            setScanParams = [0,0]
+            v_msp ='0' 
+            v_nordic='0'
+            rssi = self.__class__.WORST_RSSI
+             
             
             
+            test_time_start = time.perf_counter_ns()
+            self._end_phase(None)
+            # Only completed or failed repetitions count towards the sweep, not interrupted ones.
+            repetition_finished = False
+            try:
+                print('Run Number {}'.format(index))
+                print('Advertising Interval {}'.format(advInterval))
+                print('Scan Interval {}'.format(scanInterval))
+                print('Scan Window {}'.format(scanWindow))
+                
+                
+                
+                time.sleep(random.random()*advInterval*self.JITTER_SCALE)  # muddle things up, make things less deterministic by begining to scan a random time after
             
-                            """ Attempt to connect to the implant over bluetooth. """
-                            self.connection_attempt_number += 1
-    
-                            print('Bluetooth connection attempt {}'.format(self.connection_attempt_number))
+
+
+
+                """ Attempt to connect to the implant over bluetooth. """
+                self.connection_attempt_number += 1
     
-                            
-                            self.wand.enable()
+                print('Bluetooth connection attempt {}'.format(self.connection_attempt_number))
     
-                            (_, version) = self.wand.get_ipg_version()
+                
+                implant_detected = False
+                implant_connected = False
+                scan_duration_seconds = -1
+                implant_bluetooth_id = 'Unknown'
+                num_bluetooth_devices_detected = 0
+                connection_duration_seconds = -1
+                rssi = self.__class__.WORST_RSSI
+
+                # The wand and the dev kit are on different links: query the implant
+                # through the wand while the monitor reboots and is configured.
+                iteration = TaskGraph()
+                iteration.add('wand_query', lambda: self._query_wand(fw_build))
+                iteration.add('monitor_setup',
+                              lambda: self._setup_monitor(scanInterval, scanWindow))
+                iteration_results = iteration.run(self.phase_listener)
+                (v_msp, v_nordic) = iteration_results['wand_query']
+                setScanParams = iteration_results['monitor_setup']
+                self._end_phase(None)
     
-                            print('IPG Version: {}'.format(version))
-                            
-                                                        
-                            v_msp = self.wand._execute_command('v')
-                            v_nordic = self.wand._execute_command('readx 13 4 2')
-                           
+                # Scan for the device. Latencies run from when the monitor wrote the
+                # first scan command to when the device was first reported, see
+                # SentivaMonitor.device_arrival_ns for the resolution.
+                scan_start_ns = None
     
-                            #enable ble device at the specified advertising interval
-            
-                            #self.equipment.wand.enable_device_bluetooth(self.__class__.ADV_INTERVAL)
+                all_detected_devices = []
+                for attempt in range(0, self.__class__.MAX_SCAN_ATTEMPTS):
+                    print("{}/{} Scanning for device".format(attempt+1, self.__class__.MAX_SCAN_ATTEMPTS))
+                    all_detected_devices += self.implant_monitor.ble_scan(
+                        self.SCAN_DURATION) or []
+                    if scan_start_ns is None:
+                        scan_start_ns = self.implant_monitor.scan_started_ns
     
-                            # Reset the implant monitor and scan for the implant.
-                            
-                            
+                    implant_detected = self.__class__.EXPECTED_BLUETOOTH_NAME in \
+                                       [x.name for x in all_detected_devices]
     
-                            implant_detected = False
-                            implant_connected = False
-                            scan_duration_seconds = -1
-                            implant_bluetooth_id = 'Unknown'
-                            num_bluetooth_devices_detected = 0
-                            connection_duration_seconds = -1
-                            rssi = self.__class__.WORST_RSSI
+                    if implant_detected:
+                        scan_duration_seconds = elapsed_seconds(scan_start_ns,
+                            self.implant_monitor.device_arrival_ns(
+                                self.__class__.EXPECTED_BLUETOOTH_NAME))
+                        break
     
-                            time.sleep(1.0)
-
-                            #Reset the monitor at the beginning of each test
-                            self.implant_monitor.reset()
-                            setScanParams = self.implant_monitor.setScanParams(scanInterval,scanWindow)
-                
-                            # Scan for the device.
-                            scan_start_time = time.time() #self.timer.get_time()
                 
-                            all_detected_devices = []
-                            for attempt in range(0, self.__class__.MAX_SCAN_ATTEMPTS):
-                                print("{}/{} Scanning for device".format(attempt+1, self.__class__.MAX_SCAN_ATTEMPTS))
-                                all_detected_devices += self.implant_monitor.ble_scan(
-                                    self.__class__.SCAN_DURATION)
-                
-                                implant_detected = self.__class__.EXPECTED_BLUETOOTH_NAME in \
-                                                   [x.name for x in all_detected_devices]
-                
-                                if implant_detected:
-                                    scan_duration_seconds = time.time() - scan_start_time
-                                    break
-                
-                            
-                
-                            detected_devices = set(all_detected_devices)
-                            num_bluetooth_devices_detected = len(detected_devices)
-                            #display all discovered devices
-                            for device in detected_devices:
-                                print("SCAN: Found Device named {}".format(device.name))
-                            # If the device was not found in the scan, abort out now - we can't connect.
-                            if implant_detected is False:
-                                scan_duration_seconds = time.time() - scan_start_time
-                                raise DevKitConnectionException('Device not found during bluetooth scan',-1)
-                
-                            for device in detected_devices:
-                                if device.name == self.__class__.EXPECTED_BLUETOOTH_NAME:
-                                    implant_bluetooth_id = device.identifier
-                                    break
-                
-                            # Connect to the bluetooth device.
-                            time.sleep(random.random()*advInterval)  # muddle things up, make things less deterministic by begining to connect a random time after
-                            connection_start_time = time.time()
-                            
-                            print("Attempting to connect to Device")
-
-                            try:
-                                self.implant_monitor.ble_connect(
-                                    
-                                        self.__class__.EXPECTED_BLUETOOTH_NAME,self.__class__.MAX_SCAN_ATTEMPTS)  # set same timeout for connect as for scan
-                                implant_connected = True
-                                print("Connected to Implant")
-                            except Exception:
-                                connection_duration_seconds = time.time() - connection_start_time
-                                implant_connected = False
-                                raise DevKitConnectionException('Failed to connect to IPG over BLE',-1)
-                
-                            
-                            
+    
+                detected_devices = set(all_detected_devices)
+                num_bluetooth_devices_detected = len(detected_devices)
+                #display all discovered devices
+                for device in detected_devices:
+                    print("SCAN: Found Device named {}".format(device.name))
+                # If the device was not found in the scan, abort out now - we can't connect.
+                if implant_detected is False:
+                    scan_duration_seconds = elapsed_seconds(scan_start_ns)
+                    raise DevKitConnectionException('Device not found during bluetooth scan',DEVICE_NOT_FOUND)
+    
+                for device in detected_devices:
+                    if device.name == self.__class__.EXPECTED_BLUETOOTH_NAME:
+                        implant_bluetooth_id = device.identifier
+                        break
+                self._end_phase('scan')
+    
+                # Connect to the bluetooth device.
+                time.sleep(random.random()*advInterval*self.JITTER_SCALE)  # muddle things up, make things less deterministic by begining to connect a random time after
+                connection_start_ns = time.perf_counter_ns()
                 
-                            connection_duration_seconds = time.time() - connection_start_time
-                            print('Scan Latency {} s'.format(connection_duration_seconds))
-                            print('Connection Latency {} s'.format(scan_duration_seconds))
+                print("Attempting to connect to Device")
+
+                try:
+                    self.implant_monitor.ble_connect(
+                        
+                            self.__class__.EXPECTED_BLUETOOTH_NAME,self.__class__.MAX_SCAN_ATTEMPTS)  # set same timeout for connect as for scan
+                    implant_connected = True
+                    print("Connected to Implant")
+                except Exception:
+                    connection_duration_seconds = elapsed_seconds(
+                        self.implant_monitor.connect_sent_ns or connection_start_ns)
+                    implant_connected = False
+                    raise DevKitConnectionException('Failed to connect to IPG over BLE',CONNECT_FAILED)
+    
                 
-                            # Finally, get the RSSI of the connection.
-                            rssi_accumulator = []
-                            for x in range(self.__class__.NUM_RSSI_SAMPLES):
-                                attempt = "{}/{}".format(x+1, self.__class__.NUM_RSSI_SAMPLES)
-                                try:
-                                    rssi = self.implant_monitor.ble_rssi()
-                                    print("{} RSSI: {} dBm".format(attempt, rssi))
-                                    rssi_accumulator.append(rssi)
-                                except Exception as ex:
-                                    #trap the exception thrown with the RSSI measurement doesn't return
-                                    print("{} RSSI: Failed to return".format(attempt))
-                                    raise DevKitConnectionException("RSSI Connection Exception")
                 
-                           
+    
+                connection_duration_seconds = elapsed_seconds(
+                    self.implant_monitor.connect_sent_ns,
+                    self.implant_monitor.connect_complete_ns)
+                print('Scan Latency {:.3f} s'.format(scan_duration_seconds))
+                print('Connection Latency {:.3f} s'.format(connection_duration_seconds))
+                self._end_phase('connect')
+    
+                # Finally, get the RSSI of the connection.
+                rssi_accumulator = []
+                for x in range(self.__class__.NUM_RSSI_SAMPLES):
+                    attempt = "{}/{}".format(x+1, self.__class__.NUM_RSSI_SAMPLES)
+                    try:
+                        rssi = self.implant_monitor.ble_rssi()
+                        print("{} RSSI: {} dBm".format(attempt, rssi))
+                        rssi_accumulator.append(rssi)
+                    except Exception as ex:
+                        #trap the exception thrown with the RSSI measurement doesn't return
+                        print("{} RSSI: Failed to return".format(attempt))
+                        raise DevKitConnectionException("RSSI Connection Exception",RSSI_FAILED)
+    
+               
+    
+                if rssi_accumulator:
+                    rssi = float(sum(rssi_accumulator) / len(rssi_accumulator))
+                    print('Connection successful. RSSI: {} dBm'.format(rssi))
+                self._end_phase('rssi')
+                self.recovery_policy.report_success()
                 
-                            if rssi_accumulator:
-                                rssi = float(sum(rssi_accumulator) / len(rssi_accumulator))
-                                print('Connection successful. RSSI: {} dBm'.format(rssi))
-                            
 
-                            test_time= time.time() - test_time_start
+                test_time= elapsed_seconds(test_time_start)
+                repetition_finished = True
 
 
-                
-                        except Exception as e:
-                            #raise Exception
-                            print("there was an exception??     "+e.message)
-                            exception_msg = e.message
-                            raise Exception
-                        finally:
-                            self.record_measurement(ind = str(index)+',',Tstamp = str(datetime.datetime.now())+',',
-                            Telapsed=str(test_time)+',',
-                            Nattempt=str(self.connection_attempt_number)+',',
-                            Bid=str(implant_bluetooth_id)+',',
-                            Bscan=str(implant_detected)+',',
-                            Tscan=str(scan_duration_seconds)+',',
-                            Bconn=str(implant_connected)+',',
-                            Tconn=str(connection_duration_seconds)+',',
-                            AdvInterval=str(advInterval)+',',
-                            ScanInterval=str(setScanParams[0])+',',
-                            ScanWindow =str(setScanParams[1])+',',                            
-                            IntervalAndWindow=str(setScanParams[0])+':'+str(setScanParams[1])+',',
-                            svn_rev = str(svn_n)+',',
-                            fw_build = fw_build+',',
-                            msp_ver = v_msp+',',
-                            nordic_ver =  v_nordic+',',
-                            error_msg = exception_msg+',',
-                            avg_rssi=str(rssi)+',',
-                            )
-                        
+    
+            except Exception as e:
+                self._end_phase('failed')
+                print('Iteration failed: {}'.format(e))
+                exception_msg = str(e)
+                repetition_finished = True
+                raise
+            finally:
+                self.record_measurement(ind = index,Tstamp = datetime.datetime.now(),
+                Telapsed=test_time,
+                Nattempt=self.connection_attempt_number,
+                Bid=implant_bluetooth_id,
+                Bscan=implant_detected,
+                Tscan=scan_duration_seconds,
+                Bconn=implant_connected,
+                Tconn=connection_duration_seconds,
+                AdvInterval=advInterval,
+                ScanInterval=setScanParams[0],
+                ScanWindow =setScanParams[1],
+                IntervalAndWindow='{}:{}'.format(setScanParams[0], setScanParams[1]),
+                svn_rev = svn_n,
+                fw_build = fw_build,
+                msp_ver = v_msp,
+                nordic_ver =  v_nordic,
+                error_msg = exception_msg,
+                avg_rssi=rssi,
+                )
+                self._end_phase('record')
+                if repetition_finished:
+                    sweep.record(combination, implant_connected is True,
+                                 scan_duration_seconds if implant_detected is True else None)
+            
 
-                        
-                        # Disconnect from the implant bluetooth connection.
-                        self.implant_monitor.ble_disconnect()
-                
-                    # Disable bluetooth on the implant.
-                    self.wand.enable()
-                    self.wand.disable_device_bluetooth()
-                            
-        #self.logFile.close()
-        #self.logFileRemote.close()
-        return 0            
\ No newline at end of file
+            
+            # Disconnect from the implant bluetooth connection.
+            self.implant_monitor.ble_disconnect()
+            self._end_phase('disconnect')
+
+        sweep.clear_checkpoint()
+
+        # Disable bluetooth on the implant.
+        self.wand.enable()
+        self.wand.disable_device_bluetooth()
+
+        return 0
+
+
+    def multi_target_callback(self, svn_n, fw_build, error_msg, expected_names=None):
+        """ Measure every implant in the chamber from one shared scan per scan parameter setting.
+
+        Notes:
+            The implants must already be advertising (radio_on 2 persists through IPG reboots), the
+            wand is not used and firmware versions are not recorded.
+
+        Args:
+            svn_n: The SVN revision of the loaded firmware.
+            fw_build: The loaded firmware build.
+            error_msg: The error message recorded when no measurement error occurs.
+            expected_names: The implant bluetooth names. Defaults to EXPECTED_BLUETOOTH_NAMES.
+
+        Raises:
+            DevKitConnectionException: No expected implant connected at a scan parameter setting,
+                after its rows are recorded.
+        """
+        if expected_names is None:
+            expected_names = self.__class__.EXPECTED_BLUETOOTH_NAMES
+
+        monitors = self.implant_monitors
+
+        for scanInterval in self.__class__.SCAN_INTERVALS:
+            for scanWindow in self.__class__.SCAN_WINDOWS:
+                test_time_start = time.perf_counter_ns()
+                self.connection_attempt_number += 1
+
+                # Every dev kit is on its own serial port, so they are set up concurrently.
+                setup = TaskGraph()
+                for index, monitor in enumerate(monitors):
+                    setup.add(index, lambda monitor=monitor: (
+                        monitor.reset(), monitor.setScanParams(scanInterval, scanWindow))[1])
+                setScanParams = setup.run()[0]
+
+                results = MultiTargetScan(self.implant_monitor, monitors, expected_names,
+                                          scan_duration=self.SCAN_DURATION,
+                                          max_scan_attempts=self.__class__.MAX_SCAN_ATTEMPTS,
+                                          num_rssi_samples=self.__class__.NUM_RSSI_SAMPLES,
+                                          worst_rssi=self.__class__.WORST_RSSI).run()
+                test_time = elapsed_seconds(test_time_start)
+
+                for index, name in enumerate(expected_names):
+                    result = results[name]
+                    self.record_measurement(ind = index,Tstamp = datetime.datetime.now(),
+                        Telapsed=test_time,
+                        Nattempt=self.connection_attempt_number,
+                        Bid=result.identifier,
+                        Bscan=result.detected,
+                        Tscan=result.scan_duration_seconds,
+                        Bconn=result.connected,
+                        Tconn=result.connection_duration_seconds,
+                        AdvInterval=0,
+                        ScanInterval=setScanParams[0],
+                        ScanWindow =setScanParams[1],
+                        IntervalAndWindow='{}:{}'.format(setScanParams[0], setScanParams[1]),
+                        svn_rev = svn_n,
+                        fw_build = fw_build,
+                        msp_ver = '0',
+                        nordic_ver = '0',
+                        error_msg = result.error_msg or error_msg,
+                        avg_rssi=result.rssi,
+                        )
+
+                if not any(results[name].connected for name in expected_names):
+                    if not any(results[name].detected for name in expected_names):
+                        raise DevKitConnectionException('No implant found during bluetooth scan',
+                                                        DEVICE_NOT_FOUND)
+                    raise DevKitConnectionException('Failed to connect to any implant over BLE',
+                                                    CONNECT_FAILED)
+
+        self.recovery_policy.report_success()
+        return 0
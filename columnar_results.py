@@ -0,0 +1,300 @@
+#!/usr/bin/python3
+"""
+Description: Append-only columnar binary storage of the connectivity test results.
+
+Each run is a directory holding:
+    schema.json  The format version and the name and little-endian NumPy dtype of every column.
+    <column>.col The packed values of one column, appended row by row.
+    strings.txt  The string dictionary, one JSON encoded string per line. String columns
+                 (builds, versions, device identifiers, errors) store indices into it.
+
+The row count is the shortest column, so a row interrupted mid-write is ignored. The reader
+memory-maps the column files as NumPy arrays without copying and can export the historic CSV
+layout. Writing only needs the standard library; NumPy is imported when a run is first read.
+"""
+
+import argparse
+import datetime
+import json
+import math
+import os
+import struct
+import sys
+import time
+
+
+FORMAT_VERSION = 2
+# Version 1 stored adv_interval as '<i2'. The reader takes each column's dtype from the schema,
+# so it still reads version 1 runs.
+READABLE_VERSIONS = (1, FORMAT_VERSION)
+
+# Column name, NumPy dtype, kind. The order matches the fields of a measurement row; the
+# IntervalAndWindow field is not stored as it is derived from the scan interval and window.
+COLUMNS = [
+    ('index', '<i4', 'int'),
+    ('timestamp', '<f8', 'timestamp'),
+    ('test_time', '<f8', 'float'),
+    ('attempt', '<i4', 'int'),
+    ('device_id', '<u4', 'string'),
+    ('scan_success', '<u1', 'flag'),
+    ('scan_latency', '<f8', 'float'),
+    ('connect_success', '<u1', 'flag'),
+    ('connect_latency', '<f8', 'float'),
+    ('adv_interval', '<f8', 'float'),
+    ('scan_interval', '<i2', 'int'),
+    ('scan_window', '<i2', 'int'),
+    (None, None, 'derived'),
+    ('svn_rev', '<i4', 'int'),
+    ('fw_build', '<u4', 'string'),
+    ('msp_ver', '<u4', 'string'),
+    ('nordic_ver', '<u4', 'string'),
+    ('error_msg', '<u4', 'string'),
+    ('rssi', '<f8', 'float'),
+]
+
+# Stored value of a flag that was neither True nor False (e.g. the test failed before the step).
+FLAG_UNKNOWN = 255
+
+STRUCT_CODES = {'<i2': '<h', '<i4': '<i', '<u1': '<B', '<u4': '<I', '<f8': '<d'}
+
+
+def _to_int(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return -1
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _to_flag(value):
+    if value is True or value == 'True':
+        return 1
+    if value is False or value == 'False':
+        return 0
+    return FLAG_UNKNOWN
+
+
+def _to_timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    try:
+        return datetime.datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return _to_float(value)
+
+
+class ColumnarResultSink():
+    """ Result sink appending measurement rows to a columnar run directory.
+
+    The run directory is not created until the first row is written.
+    """
+
+    def __init__(self, directory, run_name=None, flush_every=1):
+        """ Initialize the sink.
+
+        Args:
+            directory: The directory run directories are created in.
+            run_name: The name of this run's directory. Defaults to the time of the first row.
+            flush_every: The number of rows between flushes of the column files.
+        """
+        self.directory = directory
+        self.run_name = run_name
+        self.flush_every = flush_every
+        self.path = None
+
+        self._files = None
+        self._strings = {}
+        self._strings_file = None
+        self._unflushed = 0
+
+
+    def _open(self):
+        if self.run_name is None:
+            self.run_name = 'run_' + time.strftime('%Y%m%d_%H%M%S')
+        self.path = os.path.join(self.directory, self.run_name)
+        os.makedirs(self.path, exist_ok=True)
+
+        schema_path = os.path.join(self.path, 'schema.json')
+        schema = {'version': FORMAT_VERSION,
+                  'columns': [{'name': name, 'dtype': dtype, 'kind': kind}
+                              for (name, dtype, kind) in COLUMNS if name is not None]}
+        if os.path.exists(schema_path):
+            with open(schema_path) as schema_file:
+                if json.load(schema_file) != schema:
+                    raise ValueError('Run {} has a different schema'.format(self.path))
+        else:
+            with open(schema_path, 'w') as schema_file:
+                json.dump(schema, schema_file, indent=2)
+
+        strings_path = os.path.join(self.path, 'strings.txt')
+        if os.path.exists(strings_path):
+            with open(strings_path, encoding='utf-8') as strings_file:
+                for line in strings_file:
+                    self._strings.setdefault(json.loads(line), len(self._strings))
+        self._strings_file = open(strings_path, 'a', encoding='utf-8')
+
+        self._files = [open(os.path.join(self.path, name + '.col'), 'ab') if name else None
+                       for (name, _, _) in COLUMNS]
+
+
+    def _string_id(self, value):
+        value = str(value)
+        if value not in self._strings:
+            self._strings[value] = len(self._strings)
+            self._strings_file.write(json.dumps(value) + '\n')
+        return self._strings[value]
+
+
+    def write_row(self, values):
+        """ Append one measurement row.
+
+        Args:
+            values: The ordered field values of the row, as passed to record_measurement.
+        """
+        if self._files is None:
+            self._open()
+
+        converters = {'int': _to_int, 'float': _to_float, 'flag': _to_flag,
+                      'timestamp': _to_timestamp, 'string': self._string_id}
+        packed = []
+        for (name, dtype, kind), value, column_file in zip(COLUMNS, values, self._files):
+            if column_file is not None:
+                packed.append((column_file, struct.pack(STRUCT_CODES[dtype],
+                                                        converters[kind](value))))
+
+        # The dictionary must be on disk before any row refers to its new strings.
+        self._strings_file.flush()
+        for column_file, data in packed:
+            column_file.write(data)
+
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+
+
+    def flush(self):
+        """ Flush the column files to disk. """
+        if self._files is not None:
+            for column_file in self._files:
+                if column_file is not None:
+                    column_file.flush()
+        self._unflushed = 0
+
+
+    def close(self):
+        """ Close the run's files. """
+        if self._files is None:
+            return
+
+        self.flush()
+        for column_file in self._files:
+            if column_file is not None:
+                column_file.close()
+        self._strings_file.close()
+        self._files = None
+
+
+class ColumnarResults():
+    """ Read a columnar run directory with its columns memory-mapped as NumPy arrays. """
+
+    def __init__(self, path):
+        """ Open a run.
+
+        Args:
+            path: The run directory.
+        """
+        import numpy
+
+        self._numpy = numpy
+        self.path = path
+        with open(os.path.join(path, 'schema.json')) as schema_file:
+            schema = json.load(schema_file)
+        if schema['version'] not in READABLE_VERSIONS:
+            raise ValueError('Unsupported columnar results version {}'.format(schema['version']))
+
+        self.columns = {column['name']: column for column in schema['columns']}
+        with open(os.path.join(path, 'strings.txt'), encoding='utf-8') as strings_file:
+            self.strings = [json.loads(line) for line in strings_file]
+
+        self.rows = min(os.path.getsize(self._column_path(name)) //
+                        self._numpy.dtype(column['dtype']).itemsize
+                        for name, column in self.columns.items())
+
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + '.col')
+
+
+    def __len__(self):
+        return self.rows
+
+
+    def column(self, name):
+        """ A read-only memory-mapped array of a column's values.
+
+        String columns hold indices into `strings`, see `decode`.
+        """
+        dtype = self._numpy.dtype(self.columns[name]['dtype'])
+        if not self.rows:
+            return self._numpy.zeros(0, dtype)
+        return self._numpy.memmap(self._column_path(name), dtype=dtype, mode='r', shape=(self.rows,))
+
+
+    def __getitem__(self, name):
+        return self.column(name)
+
+
+    def decode(self, name):
+        """ The values of a string column as a list of strings. """
+        return [self.strings[index] for index in self.column(name)]
+
+
+    def to_csv(self, path):
+        """ Export the run in the CSV layout written by the connectivity test.
+
+        Args:
+            path: The CSV file to write.
+        """
+        columns = {name: self.column(name) for name in self.columns}
+        decoded = {name: self.decode(name) for name, column in self.columns.items()
+                   if column['kind'] == 'string'}
+        flags = {1: 'True', 0: 'False', FLAG_UNKNOWN: ' '}
+
+        with open(path, 'w') as csv_file:
+            for row in range(self.rows):
+                values = []
+                for (name, _, kind) in COLUMNS:
+                    if kind == 'derived':
+                        values.append('{}:{}'.format(columns['scan_interval'][row],
+                                                     columns['scan_window'][row]))
+                    elif kind == 'string':
+                        values.append(decoded[name][row])
+                    elif kind == 'flag':
+                        values.append(flags.get(int(columns[name][row]), ' '))
+                    elif kind == 'timestamp':
+                        values.append(datetime.datetime.fromtimestamp(float(columns[name][row])))
+                    else:
+                        values.append(columns[name][row].item())
+                csv_file.write(''.join('{},'.format(value) for value in values) + '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export a columnar results run as CSV')
+    parser.add_argument('run', help='The run directory')
+    parser.add_argument('csv', help='The CSV file to write')
+    args = parser.parse_args(argv)
+
+    results = ColumnarResults(args.run)
+    results.to_csv(args.csv)
+    print('Exported {} rows to {}'.format(len(results), args.csv))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -33,4 +33,18 @@ class DevKitConnectionException(Exception):
     def getMessage(self):
         return self.message
     def getCode(self):
-        return self.code
\ No newline at end of file
+        return self.code
+
+
+# Failure codes carried by WandCommException and DevKitConnectionException. -1 is a failure that
+# was not classified where it was raised.
+UNKNOWN_FAILURE = -1
+WAND_UNAVAILABLE = 1      # The WandComm DLL could not be loaded
+WAND_NO_RESPONSE = 2      # The wand link is up but the implant did not answer
+WAND_COMMAND_FAILED = 3   # The wand reported a failed command, or WandComm raised
+WAND_BAD_RESPONSE = 4     # The implant's reply through the wand could not be parsed
+DEVICE_NOT_FOUND = 10     # The implant was not seen in any bluetooth scan
+DEVICE_NOT_SCANNED = 11   # A connect was attempted to a device missing from the scan list
+CONNECT_FAILED = 12       # The dev kit did not complete the bluetooth connection
+RSSI_FAILED = 13          # No RSSI could be read from the connection
+DEV_KIT_BAD_RESPONSE = 14 # The dev kit's reply could not be parsed
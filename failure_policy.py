@@ -0,0 +1,268 @@
+"""
+Description: Failure classification and adaptive recovery for the bluetooth connectivity test.
+
+Failures are classified from the codes of WandCommException and DevKitConnectionException (see
+exceptions.py). Every failure class has an escalation ladder of recovery actions: the first
+failure of a class gets the cheapest action and each further consecutive failure of that class
+moves one step up the ladder, and a long streak keeps to the top of the ladder. The outcome of
+every recovery is kept in a bounded history, and an action that has recently not helped with a
+failure class is skipped for a more useful one.
+
+Only programming errors raised outside the drivers abort the run. Unexpected exceptions raised
+inside a driver (e.g. parsing a garbled reply, or .NET exceptions from WandComm) are hardware
+failures of that driver's device.
+
+Running this module checks the policy on scripted failure streaks.
+"""
+
+import collections
+import sys
+
+from exceptions import (WandCommException, DevKitConnectionException, WAND_UNAVAILABLE,
+                        WAND_NO_RESPONSE, WAND_COMMAND_FAILED, DEVICE_NOT_FOUND,
+                        DEVICE_NOT_SCANNED, CONNECT_FAILED, RSSI_FAILED)
+
+
+# Failure classes.
+WAND = 'wand'                          # Wand command failures
+WAND_UNAVAILABLE_FAILURE = 'wand_unavailable'  # The wand driver cannot be loaded at all
+IMPLANT_SILENT = 'implant_silent'      # The implant does not answer the wand
+SCAN = 'scan'                          # The implant is not advertising or not seen
+CONNECT = 'connect'                    # The bluetooth connection failed
+RSSI = 'rssi'                          # The connection did not report an RSSI
+DEV_KIT = 'dev_kit'                    # Other dev kit failures
+LINK = 'link'                          # Serial port or OS level I/O errors
+UNKNOWN = 'unknown'                    # A plain Exception raised by a driver
+INTERNAL = 'internal'                  # Programming errors outside the drivers
+
+# Recovery actions.
+RETRY = 'retry'
+BACKOFF = 'backoff'
+REBOOT_MONITOR = 'reboot_monitor'
+REHANDSHAKE_WAND = 'rehandshake_wand'
+REFLASH = 'reflash'
+ABORT = 'abort'
+
+WAND_CLASSES = {
+    WAND_UNAVAILABLE: WAND_UNAVAILABLE_FAILURE,
+    WAND_NO_RESPONSE: IMPLANT_SILENT,
+}
+
+# Driver modules, and the failure class of unexpected exceptions raised inside them.
+DRIVER_MODULES = {
+    'sentiva_monitor': DEV_KIT,
+    'sentiva_wand': WAND,
+    'simulated_drivers': DEV_KIT,
+}
+
+DEV_KIT_CLASSES = {
+    DEVICE_NOT_FOUND: SCAN,
+    DEVICE_NOT_SCANNED: CONNECT,
+    CONNECT_FAILED: CONNECT,
+    RSSI_FAILED: RSSI,
+}
+
+# The recovery actions of each failure class, cheapest first.
+DEFAULT_LADDERS = {
+    WAND: [BACKOFF, REHANDSHAKE_WAND, REFLASH],
+    WAND_UNAVAILABLE_FAILURE: [ABORT],
+    IMPLANT_SILENT: [REHANDSHAKE_WAND, BACKOFF, REFLASH],
+    SCAN: [RETRY, REHANDSHAKE_WAND, REBOOT_MONITOR, REFLASH],
+    CONNECT: [RETRY, REBOOT_MONITOR, BACKOFF],
+    RSSI: [RETRY, REBOOT_MONITOR],
+    DEV_KIT: [REBOOT_MONITOR, BACKOFF],
+    LINK: [BACKOFF, REBOOT_MONITOR],
+    UNKNOWN: [RETRY, BACKOFF, REBOOT_MONITOR],
+    INTERNAL: [ABORT],
+}
+
+# The recovery chosen for a failure. The delay in seconds is only non-zero for BACKOFF.
+Recovery = collections.namedtuple('Recovery', ['failure_class', 'action', 'delay'])
+
+
+def classify_failure(exception):
+    """ The failure class of an exception raised by a test iteration. """
+    if isinstance(exception, WandCommException):
+        return WAND_CLASSES.get(exception.code, WAND)
+    if isinstance(exception, DevKitConnectionException):
+        return DEV_KIT_CLASSES.get(exception.code, DEV_KIT)
+    if isinstance(exception, OSError):
+        # pyserial's SerialException is an OSError.
+        return LINK
+    if type(exception) is Exception:
+        return UNKNOWN
+
+    driver_class = None
+    traceback = exception.__traceback__
+    while traceback is not None:
+        module = traceback.tb_frame.f_globals.get('__name__')
+        driver_class = DRIVER_MODULES.get(module, driver_class)
+        traceback = traceback.tb_next
+    return driver_class or INTERNAL
+
+
+class RecoveryPolicy():
+    """ Pick a recovery action per failure and learn which actions help. """
+
+    def __init__(self, ladders=None, history_length=50, min_trials=3, min_success_rate=0.2,
+                 backoff_delay=2.0, max_backoff_delay=120.0):
+        """ Initialize the policy.
+
+        Args:
+            ladders: Failure class to recovery actions, cheapest first. Defaults to
+                DEFAULT_LADDERS.
+            history_length: The number of recent recovery outcomes learned from.
+            min_trials: The number of outcomes of an action before it can be judged unhelpful.
+            min_success_rate: The recent rate of recoveries below which an action is skipped.
+            backoff_delay: The delay in seconds of the first backoff of a failure streak.
+            max_backoff_delay: The longest backoff delay in seconds.
+        """
+        self.ladders = dict(DEFAULT_LADDERS if ladders is None else ladders)
+        self.history = collections.deque(maxlen=history_length)
+        self.min_trials = min_trials
+        self.min_success_rate = min_success_rate
+        self.backoff_delay = backoff_delay
+        self.max_backoff_delay = max_backoff_delay
+
+        self._pending = None
+        self._streak_class = None
+        self._streak = 0
+        self._backoffs = 0
+
+
+    def success_rate(self, failure_class, action):
+        """ How often an action recently recovered from a failure class.
+
+        Returns:
+            A tuple of (smoothed success rate, number of outcomes it is based on).
+        """
+        outcomes = [recovered for (recorded_class, recorded_action, recovered) in self.history
+                    if recorded_class == failure_class and recorded_action == action]
+        return ((sum(outcomes) + 1) / (len(outcomes) + 2), len(outcomes))
+
+
+    def _is_useful(self, failure_class, action):
+        (rate, trials) = self.success_rate(failure_class, action)
+        return trials < self.min_trials or rate >= self.min_success_rate
+
+
+    def _resolve(self, recovered):
+        if self._pending is not None:
+            self.history.append(self._pending + (recovered,))
+            self._pending = None
+
+
+    def choose(self, exception):
+        """ Classify a failure and choose how to recover from it.
+
+        A failure of the same class as the previous one means the previous recovery did not
+        help; a failure of another class means it did and the test got further.
+
+        Returns:
+            The Recovery to apply.
+        """
+        failure_class = classify_failure(exception)
+
+        if failure_class == self._streak_class:
+            self._resolve(False)
+            self._streak += 1
+        else:
+            self._resolve(True)
+            self._streak_class = failure_class
+            self._streak = 1
+            self._backoffs = 0
+
+        ladder = self.ladders.get(failure_class, self.ladders[UNKNOWN])
+        candidates = ladder[min(self._streak, len(ladder)) - 1:]
+        useful = [action for action in candidates if self._is_useful(failure_class, action)]
+        if useful:
+            action = useful[0]
+        else:
+            # Nothing left on the ladder has helped lately: fall back to its best action.
+            action = max(ladder, key=lambda action: self.success_rate(failure_class, action)[0])
+
+        delay = 0
+        if action == BACKOFF:
+            delay = min(self.backoff_delay * 2 ** self._backoffs, self.max_backoff_delay)
+            self._backoffs += 1
+
+        if action != ABORT:
+            self._pending = (failure_class, action)
+        return Recovery(failure_class, action, delay)
+
+
+    def report_success(self):
+        """ Record that a test iteration succeeded, ending any failure streak. """
+        self._resolve(True)
+        self._streak_class = None
+        self._streak = 0
+        self._backoffs = 0
+
+
+def _check(condition, description):
+    if not condition:
+        raise AssertionError('failure_policy self check failed: ' + description)
+
+
+def self_check():
+    """ Check how the policy escalates and learns on scripted failure streaks. """
+    scan_failure = DevKitConnectionException('Device not found during bluetooth scan',
+                                             DEVICE_NOT_FOUND)
+
+    # A persistent SCAN failure climbs the ladder, stays at the top until it stops helping and
+    # then cycles through the ladder's best actions.
+    policy = RecoveryPolicy()
+    actions = [policy.choose(scan_failure).action for _ in range(11)]
+    expected = [RETRY, REHANDSHAKE_WAND, REBOOT_MONITOR, REFLASH, REFLASH, REFLASH, REFLASH,
+                RETRY, REHANDSHAKE_WAND, REBOOT_MONITOR, RETRY]
+    _check(actions == expected, 'SCAN escalation {}'.format(actions))
+
+    # A long streak of any failure class but the unrecoverable ones never aborts.
+    failures = {
+        WAND: WandCommException('Failed to run command', WAND_COMMAND_FAILED),
+        IMPLANT_SILENT: WandCommException('No response from the IPG', WAND_NO_RESPONSE),
+        SCAN: scan_failure,
+        CONNECT: DevKitConnectionException('Could not Connect over BLE', CONNECT_FAILED),
+        RSSI: DevKitConnectionException('RSSI Connection Exception', RSSI_FAILED),
+        DEV_KIT: DevKitConnectionException('Unexpected reply'),
+        LINK: OSError('could not open port'),
+        UNKNOWN: Exception('No RSSI detected. Is the device connected?'),
+    }
+    for failure_class, exception in failures.items():
+        policy = RecoveryPolicy()
+        recoveries = [policy.choose(exception) for _ in range(200)]
+        _check(all(recovery.failure_class == failure_class for recovery in recoveries),
+               '{} classification'.format(failure_class))
+        _check(ABORT not in [recovery.action for recovery in recoveries],
+               '{} streak aborted'.format(failure_class))
+
+    # Only an unavailable wand and programming errors outside the drivers abort.
+    policy = RecoveryPolicy()
+    _check(policy.choose(WandCommException('No wand', WAND_UNAVAILABLE)).action == ABORT,
+           'unavailable wand does not abort')
+    _check(policy.choose(TypeError('a bug')).action == ABORT, 'programming error does not abort')
+
+    # An action that keeps not helping is skipped at the start of later streaks.
+    policy = RecoveryPolicy()
+    for _ in range(4):
+        policy.choose(scan_failure)
+        policy.choose(scan_failure)
+        policy.report_success()
+    _check(policy.success_rate(SCAN, RETRY) == (1 / 6, 4), 'RETRY outcomes')
+    _check(policy.choose(scan_failure).action == REHANDSHAKE_WAND, 'unhelpful RETRY not skipped')
+
+    # Backoff doubles within a streak up to its maximum, and restarts after a success.
+    policy = RecoveryPolicy(ladders={WAND: [BACKOFF], UNKNOWN: [RETRY]}, backoff_delay=2.0,
+                            max_backoff_delay=10.0)
+    wand_failure = failures[WAND]
+    delays = [policy.choose(wand_failure).delay for _ in range(5)]
+    _check(delays == [2.0, 4.0, 8.0, 10.0, 10.0], 'backoff delays {}'.format(delays))
+    policy.report_success()
+    _check(policy.choose(wand_failure).delay == 2.0, 'backoff not restarted')
+
+    print('failure_policy self check passed')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(self_check())
@@ -0,0 +1,217 @@
+"""
+Description: Rotating, compressed result logs shipped to a remote directory in the background.
+
+Rows are appended to a local CSV segment. A segment is closed once it reaches a size or age
+limit, then a background worker compresses it and copies it to the remote directory (e.g. a Box
+Sync folder) with retries. Remote files are only ever created whole under a new name, so sync
+clients upload each closed segment once and existing data is never truncated or rewritten.
+Shipped segments are moved to a local subdirectory, so only unshipped ones are queued again when
+a run starts.
+"""
+
+import glob
+import gzip
+import os
+import queue
+import shutil
+import threading
+import time
+
+
+# The subdirectory of the local directory that shipped segments are moved to.
+SHIPPED_DIRECTORY = 'shipped'
+
+
+class LogShipper():
+    """ Compress closed log segments and copy them to a remote directory from a worker thread. """
+
+    def __init__(self, remote_directory, retry_delay=5.0, max_retry_delay=300.0):
+        """ Initialize the shipper.
+
+        Args:
+            remote_directory: The directory compressed segments are copied to.
+            retry_delay: The first delay in seconds before retrying a failed copy.
+            max_retry_delay: The longest delay in seconds between retries.
+        """
+        self.remote_directory = remote_directory
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.shipped = 0
+        self.failures = 0
+
+        self._queue = queue.Queue()
+        self._stop = threading.Event()
+        self._worker = None
+
+
+    def start(self):
+        """ Start the background worker. """
+        if self._worker is None:
+            self._stop.clear()
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+
+
+    def submit(self, path):
+        """ Queue a closed segment (plain or already compressed) for shipping. """
+        self._queue.put(path)
+
+
+    def stop(self, timeout=30.0):
+        """ Ship what is queued, waiting at most timeout seconds, then stop the worker. """
+        if self._worker is None:
+            return
+
+        self._queue.put(None)
+        self._worker.join(timeout)
+        self._stop.set()
+        self._worker = None
+
+
+    def _run(self):
+        delay = self.retry_delay
+        while True:
+            path = self._queue.get()
+            if path is None:
+                return
+
+            try:
+                path = self._compress(path)
+                self._copy(path)
+                self._archive(path)
+                self.shipped += 1
+                delay = self.retry_delay
+            except OSError as e:
+                self.failures += 1
+                print('Log shipping of {} failed, retrying in {} s: {}'.format(path, delay, e))
+                self._queue.put(path)
+                if self._stop.wait(delay):
+                    return
+                delay = min(delay * 2, self.max_retry_delay)
+
+
+    def _compress(self, path):
+        """ Compress a closed segment in place.
+
+        Returns:
+            The path of the compressed segment.
+        """
+        if path.endswith('.gz'):
+            return path
+
+        compressed = path + '.gz'
+        with open(path, 'rb') as source, gzip.open(compressed + '.tmp', 'wb') as target:
+            shutil.copyfileobj(source, target)
+        os.replace(compressed + '.tmp', compressed)
+        os.remove(path)
+        return compressed
+
+
+    def _copy(self, path):
+        """ Copy a compressed segment to the remote directory unless it is already there. """
+        remote = os.path.join(self.remote_directory, os.path.basename(path))
+        if os.path.exists(remote):
+            return
+
+        os.makedirs(self.remote_directory, exist_ok=True)
+        # Copy under a temporary name so sync clients never pick up a partial file.
+        shutil.copyfile(path, remote + '.tmp')
+        os.replace(remote + '.tmp', remote)
+
+
+    def _archive(self, path):
+        """ Move a shipped segment to the shipped subdirectory next to it. """
+        shipped = os.path.join(os.path.dirname(path), SHIPPED_DIRECTORY)
+        os.makedirs(shipped, exist_ok=True)
+        os.replace(path, os.path.join(shipped, os.path.basename(path)))
+
+
+class ShippedCsvSink():
+    """ Result sink writing rotating local CSV segments that are shipped to a remote directory.
+
+    Nothing is created on disk and no thread is started until the first row is written.
+    """
+
+    def __init__(self, local_directory, name, remote_directory, max_bytes=1024 * 1024,
+                 max_age=3600.0, shipper=None):
+        """ Initialize the sink.
+
+        Args:
+            local_directory: The directory local segments are written to.
+            name: The prefix of every segment file name.
+            remote_directory: The directory compressed segments are shipped to.
+            max_bytes: The size in bytes at which a segment is closed.
+            max_age: The age in seconds at which a segment is closed.
+            shipper: The LogShipper to use. Defaults to one shipping to remote_directory.
+        """
+        self.local_directory = local_directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.shipper = shipper or LogShipper(remote_directory)
+
+        self._file = None
+        self._path = None
+        self._opened_at = 0.0
+        self._sequence = 0
+        self._started = False
+
+
+    def _start(self):
+        """ Start the shipper and requeue unshipped segments left behind by a previous run. """
+        os.makedirs(self.local_directory, exist_ok=True)
+        pattern = os.path.join(self.local_directory, glob.escape(self.name) + '_*.csv')
+        for path in sorted(glob.glob(pattern) + glob.glob(pattern + '.gz')):
+            self.shipper.submit(path)
+        self.shipper.start()
+        self._started = True
+
+
+    def _open_segment(self):
+        # Never reuse the name of an existing segment, e.g. one left by a run in the same second.
+        while True:
+            self._sequence += 1
+            self._path = os.path.join(self.local_directory, '{}_{}_{:04d}.csv'.format(
+                self.name, time.strftime('%Y%m%d_%H%M%S'), self._sequence))
+            shipped = os.path.join(self.local_directory, SHIPPED_DIRECTORY,
+                                   os.path.basename(self._path) + '.gz')
+            if not any(os.path.exists(path) for path in (self._path, self._path + '.gz', shipped)):
+                break
+        self._file = open(self._path, 'a')
+        self._opened_at = time.time()
+
+
+    def rotate(self):
+        """ Close the current segment and hand it to the shipper. """
+        if self._file is None:
+            return
+
+        self._file.close()
+        self._file = None
+        self.shipper.submit(self._path)
+
+
+    def write_row(self, values):
+        """ Append one row. Every value is followed by a comma, matching the historic log layout.
+
+        Args:
+            values: The ordered field values of the row.
+        """
+        if not self._started:
+            self._start()
+
+        if self._file is not None and (self._file.tell() >= self.max_bytes or
+                                       time.time() - self._opened_at >= self.max_age):
+            self.rotate()
+        if self._file is None:
+            self._open_segment()
+
+        self._file.write(''.join('{},'.format(value) for value in values) + '\n')
+        self._file.flush()
+
+
+    def close(self, timeout=30.0):
+        """ Close the current segment and wait up to timeout seconds for shipping to finish. """
+        self.rotate()
+        self.shipper.stop(timeout)
+        self._started = False
@@ -0,0 +1,174 @@
+"""
+Description: Multi-implant scanning for the bluetooth connectivity test.
+
+A single scan loop on one dev kit records the discovery time of every expected implant it sees.
+Each discovered implant is queued and picked up by whichever dev kit in the pool is free, which
+then connects, samples the RSSI and disconnects. Measurement throughput therefore scales with the
+number of implants in the chamber as well as with the number of dev kits.
+"""
+
+import queue
+import threading
+import time
+
+from exceptions import DevKitConnectionException, DEVICE_NOT_FOUND, CONNECT_FAILED, RSSI_FAILED
+from timing import elapsed_seconds
+
+
+class TargetResult():
+    """ The outcome of scanning, connecting to and measuring one implant. """
+
+    def __init__(self, name, worst_rssi):
+        self.name = name
+        self.detected = False
+        self.scan_duration_seconds = -1
+        self.identifier = 'Unknown'
+        self.connected = False
+        self.connection_duration_seconds = -1
+        self.rssi = worst_rssi
+        self.monitor = None
+        self.error_msg = ''
+
+
+class MultiTargetScan():
+    """ Scan once for a set of implants and fan the connect/RSSI work out over a dev kit pool. """
+
+    def __init__(self, scan_monitor, monitors, expected_names, scan_duration=1,
+                 max_scan_attempts=600, num_rssi_samples=10, worst_rssi=-150.0):
+        """ Initialize the scan.
+
+        Args:
+            scan_monitor: The dev kit that runs the shared scan loop.
+            monitors: The dev kits available for connect/RSSI work. If the scan monitor is in this
+                pool it only takes work once the shared scan loop has finished.
+            expected_names: The bluetooth names of the implants to look for.
+            scan_duration: The duration of each scan in seconds.
+            max_scan_attempts: The number of scans before giving up on undiscovered implants.
+                Also used as the connect timeout, matching the single target test.
+            num_rssi_samples: The number of RSSI samples averaged per implant.
+            worst_rssi: The RSSI reported when no valid RSSI is measured.
+        """
+        self.scan_monitor = scan_monitor
+        self.monitors = list(monitors)
+        self.expected_names = list(expected_names)
+        self.scan_duration = scan_duration
+        self.max_scan_attempts = max_scan_attempts
+        self.num_rssi_samples = num_rssi_samples
+        self.worst_rssi = worst_rssi
+
+        self.results = {name: TargetResult(name, worst_rssi) for name in self.expected_names}
+        self._work = queue.Queue()
+
+
+    def run(self):
+        """ Run the shared scan loop and wait for all connect/RSSI work to finish.
+
+        Returns:
+            A dict of bluetooth name to TargetResult.
+        """
+        workers = [self._start_worker(monitor) for monitor in self.monitors
+                   if monitor is not self.scan_monitor]
+
+        self._scan()
+
+        if self.scan_monitor in self.monitors:
+            workers.append(self._start_worker(self.scan_monitor))
+
+        for _ in workers:
+            self._work.put(None)
+        for worker in workers:
+            worker.join()
+
+        return self.results
+
+
+    def _start_worker(self, monitor):
+        worker = threading.Thread(target=self._worker, args=(monitor,), daemon=True)
+        worker.start()
+        return worker
+
+
+    def _scan(self):
+        """ Scan until every expected implant has been discovered or the attempts run out. """
+        pending = set(self.expected_names)
+        scan_start_ns = None
+
+        for attempt in range(0, self.max_scan_attempts):
+            print("{}/{} Scanning for {} devices".format(attempt+1, self.max_scan_attempts,
+                                                         len(pending)))
+            detected_devices = self.scan_monitor.ble_scan(self.scan_duration) or []
+            if scan_start_ns is None:
+                scan_start_ns = self.scan_monitor.scan_started_ns
+
+            for device in detected_devices:
+                if device.name not in pending:
+                    continue
+
+                pending.discard(device.name)
+                result = self.results[device.name]
+                result.detected = True
+                result.scan_duration_seconds = elapsed_seconds(
+                    scan_start_ns, self.scan_monitor.device_arrival_ns(device.name))
+                result.identifier = device.identifier
+                print("SCAN: Found Device named {}".format(device.name))
+                self._work.put(device.name)
+
+            if not pending:
+                break
+
+        for name in pending:
+            self.results[name].scan_duration_seconds = elapsed_seconds(scan_start_ns)
+            self.results[name].error_msg = 'Device not found during bluetooth scan'
+
+
+    def _worker(self, monitor):
+        while True:
+            name = self._work.get()
+            if name is None:
+                return
+
+            result = self.results[name]
+            result.monitor = monitor
+            try:
+                self._measure(monitor, result)
+            except Exception as e:
+                result.error_msg = str(e)
+            finally:
+                monitor.ble_disconnect()
+
+
+    def _measure(self, monitor, result):
+        """ Connect to a discovered implant from a dev kit and sample the connection RSSI. """
+        # A dev kit only connects to devices in its latest scan list, which every scan replaces.
+        # This holds for the scan monitor too: the implant may be missing from its last scan.
+        attempts = 0
+        while result.name not in [x.name for x in monitor.scanned_devices]:
+            if attempts == self.max_scan_attempts:
+                raise DevKitConnectionException('Device not found by connecting dev kit', DEVICE_NOT_FOUND)
+            monitor.ble_scan(self.scan_duration)
+            attempts += 1
+
+        connection_start_ns = time.perf_counter_ns()
+        try:
+            monitor.ble_connect(result.name, self.max_scan_attempts)
+        except Exception as e:
+            result.connection_duration_seconds = elapsed_seconds(
+                monitor.connect_sent_ns or connection_start_ns)
+            if isinstance(e, DevKitConnectionException):
+                raise
+            raise DevKitConnectionException('Failed to connect to IPG over BLE', CONNECT_FAILED)
+
+        result.connection_duration_seconds = elapsed_seconds(monitor.connect_sent_ns,
+                                                             monitor.connect_complete_ns)
+        result.connected = True
+        print("Connected to {}".format(result.name))
+
+        rssi_accumulator = []
+        for _ in range(self.num_rssi_samples):
+            try:
+                rssi_accumulator.append(monitor.ble_rssi())
+            except Exception:
+                raise DevKitConnectionException("RSSI Connection Exception", RSSI_FAILED)
+
+        result.rssi = float(sum(rssi_accumulator) / len(rssi_accumulator))
+        print('{} RSSI: {} dBm'.format(result.name, result.rssi))
@@ -0,0 +1,98 @@
+"""
+Description: A registry of the dev kit (monitor) and wand drivers, firmware flashers and result
+sinks used by the bluetooth connectivity test.
+
+Plugins are declared by name with a 'module:attribute' target string and the module is only
+imported the first time the plugin is used. This keeps hardware dependencies (the CLR and the
+TivaComm .NET DLL for the wand, pyserial and recordclass for the monitor) out of dry runs,
+analysis scripts and CI.
+"""
+
+import importlib
+
+
+class PluginRegistry():
+    """ Name to lazily imported class lookup, grouped by plugin kind. """
+
+    MONITOR = 'monitor'
+    WAND = 'wand'
+    FLASHER = 'flasher'
+    SINK = 'sink'
+
+    def __init__(self):
+        self._targets = {}
+        self._loaded = {}
+
+
+    def register(self, kind, name, target):
+        """ Declare a plugin without importing it.
+
+        Args:
+            kind: The kind of plugin (monitor, wand, flasher or sink).
+            name: The name the plugin is looked up by.
+            target: A 'module:attribute' string naming the class or factory to load.
+        """
+        if ':' not in target:
+            raise ValueError('Plugin target {} is not of the form module:attribute'.format(target))
+
+        self._targets[(kind, name)] = target
+        self._loaded.pop((kind, name), None)
+
+
+    def names(self, kind):
+        """ The names of all plugins registered for a kind. """
+        return sorted(name for (k, name) in self._targets if k == kind)
+
+
+    def is_loaded(self, kind, name):
+        """ Determine if a plugin's module has already been imported. """
+        return (kind, name) in self._loaded
+
+
+    def get(self, kind, name):
+        """ Import (on first use) and return a registered plugin.
+
+        Args:
+            kind: The kind of plugin.
+            name: The registered name of the plugin.
+
+        Returns:
+            The class or factory named by the plugin target.
+        """
+        key = (kind, name)
+        if key not in self._loaded:
+            try:
+                target = self._targets[key]
+            except KeyError:
+                raise KeyError('No {} plugin named {} (known: {})'.format(
+                    kind, name, ', '.join(self.names(kind)))) from None
+
+            module_name, attribute = target.split(':', 1)
+            module = importlib.import_module(module_name)
+            self._loaded[key] = getattr(module, attribute)
+
+        return self._loaded[key]
+
+
+    def create(self, kind, name, *args, **kwargs):
+        """ Import (on first use) and instantiate a registered plugin. """
+        return self.get(kind, name)(*args, **kwargs)
+
+
+registry = PluginRegistry()
+
+registry.register(PluginRegistry.MONITOR, 'sentiva_monitor', 'sentiva_monitor:SentivaMonitor')
+registry.register(PluginRegistry.MONITOR, 'simulated_monitor', 'simulated_drivers:SimulatedMonitor')
+registry.register(PluginRegistry.MONITOR, 'simulated_port_monitor',
+                  'simulated_drivers:simulated_port_monitor')
+
+registry.register(PluginRegistry.WAND, 'sentiva_wand', 'sentiva_wand:SentivaWand')
+registry.register(PluginRegistry.WAND, 'simulated_wand', 'simulated_drivers:SimulatedWand')
+
+registry.register(PluginRegistry.FLASHER, 'svn', 'FW_From_SVN:FW_From_SVN')
+registry.register(PluginRegistry.FLASHER, 'msp', 'MSP_FW_Loader:MSP_FW_Loader')
+registry.register(PluginRegistry.FLASHER, 'nordic', 'Nordic_FW_Loader:Nordic_FW_Loader')
+
+registry.register(PluginRegistry.SINK, 'csv', 'results_sink:CsvResultSink')
+registry.register(PluginRegistry.SINK, 'shipped_csv', 'log_shipper:ShippedCsvSink')
+registry.register(PluginRegistry.SINK, 'columnar', 'columnar_results:ColumnarResultSink')
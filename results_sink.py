@@ -0,0 +1,42 @@
+"""
+Description: Destinations for the rows written by the bluetooth connectivity test.
+"""
+
+
+class CsvResultSink():
+    """ Write measurement rows to a CSV file.
+
+    The file is not opened until the first row is written, so constructing a sink (e.g. for a
+    dry run) never touches the filesystem.
+    """
+
+    def __init__(self, path, mode='w+'):
+        """ Initialize the sink.
+
+        Args:
+            path: The file to write rows to.
+            mode: The mode the file is opened with on first write.
+        """
+        self.path = path
+        self.mode = mode
+        self._file = None
+
+
+    def write_row(self, values):
+        """ Write one row. Every value is followed by a comma, matching the historic log layout.
+
+        Args:
+            values: The ordered field values of the row.
+        """
+        if self._file is None:
+            self._file = open(self.path, self.mode)
+
+        self._file.write(''.join('{},'.format(value) for value in values) + '\n')
+        self._file.flush()
+
+
+    def close(self):
+        """ Close the underlying file, if it was ever opened. """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -15,12 +15,97 @@ import sys
 #from autotest.framework.timer import RealTimer
 
 from bluetooth_rf_connectivity_test import BluetoothConnectivityTest
+from plugin_registry import registry, PluginRegistry
+from failure_policy import ABORT, REFLASH
 
-from MSP_FW_Loader import MSP_FW_Loader
-from FW_From_SVN import FW_From_SVN
-from Nordic_FW_Loader import Nordic_FW_Loader
 
-def main():
+def parse_args(argv=None):
+    """ Parse the command line arguments of the test runner. """
+    parser = argparse.ArgumentParser(description='Sentiva 2.0 bluetooth RF connectivity test')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Print the configured plugins and exit without touching hardware')
+    parser.add_argument('--monitor', default='sentiva_monitor',
+                        choices=registry.names(PluginRegistry.MONITOR),
+                        help='Registered implant monitor driver')
+    parser.add_argument('--wand', default='sentiva_wand',
+                        choices=registry.names(PluginRegistry.WAND),
+                        help='Registered wand driver')
+    parser.add_argument('--multi-target', nargs='+', metavar='NAME',
+                        help='Measure every named implant from one shared scan')
+    parser.add_argument('--monitor-port', action='append', metavar='PORT:SERIAL',
+                        help='A dev kit to use, may be repeated. The first one scans')
+    args = parser.parse_args(argv)
+    if args.monitor_port:
+        args.monitor_port = [tuple(port.split(':', 1)) for port in args.monitor_port]
+        for port in args.monitor_port:
+            if len(port) != 2 or not all(port):
+                parser.error('--monitor-port {} must be given as PORT:SERIAL'.format(':'.join(port)))
+    return args
+
+
+def dry_run(args):
+    """ Report what a run would use. Nothing is imported, opened or flashed. """
+    ports = args.monitor_port or BluetoothConnectivityTest.MONITOR_PORTS
+    print('Monitor driver: {} on {}'.format(args.monitor, ', '.join(port for (port, _) in ports)))
+    print('Wand driver: {}'.format(args.wand))
+    print('Expected devices: {}'.format(
+        ', '.join(args.multi_target or [BluetoothConnectivityTest.EXPECTED_BLUETOOTH_NAME])))
+    print('Local log: {}'.format(os.path.join(
+        os.path.abspath(BluetoothConnectivityTest.LOG_DIRECTORY),
+        BluetoothConnectivityTest.LOG_NAME + '_*.csv')))
+    print('Remote log directory: {}'.format(BluetoothConnectivityTest.REMOTE_LOG_DIRECTORY))
+    print('Columnar results: {}'.format(
+        os.path.abspath(BluetoothConnectivityTest.RESULTS_DIRECTORY)))
+    print('Repetitions per combination: {} to {}, checkpoint {}'.format(
+        BluetoothConnectivityTest.SWEEP_MIN_REPETITIONS,
+        BluetoothConnectivityTest.SWEEP_MAX_REPETITIONS,
+        os.path.abspath(BluetoothConnectivityTest.SWEEP_CHECKPOINT)))
+    for kind in (PluginRegistry.MONITOR, PluginRegistry.WAND, PluginRegistry.FLASHER,
+                 PluginRegistry.SINK):
+        print('Registered {}s: {}'.format(kind, ', '.join(registry.names(kind))))
+    return 0
+
+
+def run_cycle(test, svn_n, fw_build, error_msg, expected_names=None, reflash=None):
+    """ Run one test cycle and recover from a failure the way the recovery policy picks.
+
+    Args:
+        test: The BluetoothConnectivityTest to run.
+        svn_n: The SVN revision of the loaded firmware.
+        fw_build: The loaded firmware build.
+        error_msg: The error message recorded when no measurement error occurs.
+        expected_names: The implants of a multi-target run, or None for the single target test.
+        reflash: Called to reflash the implant when the policy picks it. Reflashing is skipped
+            without it.
+
+    Returns:
+        A tuple of (whether the cycle succeeded, the error message for the next cycle).
+    """
+    try:
+        if expected_names:
+            test.multi_target_callback(svn_n, fw_build, error_msg, expected_names)
+        else:
+            test.connection_callback(svn_n, fw_build, error_msg)
+        return (True, error_msg)
+    except Exception as ex:
+        recovery = test.recover(ex)
+        if recovery.action == ABORT:
+            raise
+        if recovery.action == REFLASH and reflash is not None:
+            try:
+                reflash()
+                error_msg = "reflashed after {} failure".format(recovery.failure_class)
+            except Exception:
+                error_msg = "firmwareload error"
+                print ("FW load exception")
+        return (False, error_msg)
+
+
+def main(argv=None):
+
+    args = parse_args(argv)
+    if args.dry_run:
+        return dry_run(args)
 
     #test = BluetoothConnectivityTest()
     #while True:
@@ -30,11 +115,12 @@ def main():
     latestRevisionNumber='0'
     latestBuildNumber    = '0'
     
-    test = BluetoothConnectivityTest()
-        
-    fw_svn = FW_From_SVN()
-    mspFW_loader = MSP_FW_Loader()
-    nordicLoader = Nordic_FW_Loader()
+    test = BluetoothConnectivityTest(monitor_driver=args.monitor, wand_driver=args.wand,
+                                     monitor_ports=args.monitor_port)
+
+    fw_svn = registry.create(PluginRegistry.FLASHER, 'svn')
+    mspFW_loader = registry.create(PluginRegistry.FLASHER, 'msp')
+    nordicLoader = registry.create(PluginRegistry.FLASHER, 'nordic')
     
     fw_svn.getTopOfTrunkFW()
     latestBuildNumber = fw_svn.getLatestFWBuildNumber()
@@ -46,29 +132,36 @@ def main():
     nordicLoader.programNordic(NordicFWFolder=latestBuildNumber)
     
     
+    def reflash():
+        mspFW_loader.programMSP(latestBuildNumber)
+        nordicLoader.programNordic(NordicFWFolder=latestBuildNumber)
+
     error_msg = ""
-    while True:
-        if (latestBuildNumber != fw_svn.getLatestFWBuildNumber()):
-            try:
-                print("loaded firmware is not latest from SVN")
-                print ("\r\n\r\n")
-                fw_svn.getTopOfTrunkFW()
-                latestBuildNumber = fw_svn.getLatestFWBuildNumber()
-                latestRevisionNumber = fw_svn.getLatestRevisionNumber()
-                mspFW_loader.programMSP(latestBuildNumber)
-                nordicLoader.programNordic(NordicFWFolder=latestBuildNumber)
-                error_msg = "No errors"
-            except Exception:
-                error_msg = "firmwareload error"
-                print ("FW load exception")
-                #raise Exception("FW Load")
-    
-        else:
-            try:
-                test.connection_callback(latestRevisionNumber,latestBuildNumber,error_msg)
-            except Exception as ex:
-                #raise Exception
-                print (ex)
-        
+    try:
+        while True:
+            if (latestBuildNumber != fw_svn.getLatestFWBuildNumber()):
+                try:
+                    print("loaded firmware is not latest from SVN")
+                    print ("\r\n\r\n")
+                    fw_svn.getTopOfTrunkFW()
+                    latestBuildNumber = fw_svn.getLatestFWBuildNumber()
+                    latestRevisionNumber = fw_svn.getLatestRevisionNumber()
+                    mspFW_loader.programMSP(latestBuildNumber)
+                    nordicLoader.programNordic(NordicFWFolder=latestBuildNumber)
+                    error_msg = "No errors"
+                except Exception:
+                    error_msg = "firmwareload error"
+                    print ("FW load exception")
+                    #raise Exception("FW Load")
+
+            else:
+                (_, error_msg) = run_cycle(test, latestRevisionNumber, latestBuildNumber, error_msg,
+                                           args.multi_target, reflash)
+    finally:
+        # Close the current log segments so they are shipped, e.g. on Ctrl-C.
+        for sink in test.sinks:
+            sink.close()
+
 
-main()
+if __name__ == '__main__':
+    sys.exit(main())
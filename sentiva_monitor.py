@@ -5,13 +5,15 @@ Description: Driver for the Nordic breakout board that communicates with the Sen
 """
 
 import re
+import threading
 import time
 
 import recordclass
 import serial
 
 
-from exceptions import DevKitConnectionException
+from exceptions import (DevKitConnectionException, DEVICE_NOT_SCANNED, CONNECT_FAILED,
+                        DEV_KIT_BAD_RESPONSE)
 #from serial_util import serial_util
 
 
@@ -21,12 +23,23 @@ class SentivaMonitor():
     USB_VID = int('1366', 16)
     USB_PID = int('1015', 16)
 
+    # The default time to wait for a command's response, in seconds.
+    COMMAND_TIMEOUT = 0.5
+
+    # The longest the reader thread blocks on the port, in seconds. It only bounds how quickly
+    # the thread notices a shutdown; output is timestamped as soon as the blocking read returns.
+    READ_TIMEOUT = 0.05
+
+    # How long RSSI reporting runs before it is stopped, and the stop command's timeout, in seconds.
+    RSSI_DURATION = 2
+    STOP_RSSI_TIMEOUT = 0.1
+
     ScannedDevice = recordclass.recordclass('ScannedDevice', ['name', 'identifier', 'index'])
 
     ScannedDevice.__hash__ = lambda x: hash((x.name, x.identifier, x.index))
 
 
-    def __init__(self, name, serial_number=None, device_filter=None):
+    def __init__(self, name, serial_number=None, device_filter=None, port=None):
         """ Initialize a USB serial device.
 
         Args:
@@ -36,19 +49,107 @@ class SentivaMonitor():
             device_filter: A function that will be provided the `serial.ListPortInfo` objects
                 detected with the respective VID/PID that shall return True if the device should be
                 considered further. This is typically a lambda function.
+            port: An already open serial port (or compatible object) to use instead of opening
+                the named port. Used to run the driver against a simulated transport.
 
         Note:
             This function searches available USB COM ports for the specified VID, PID, and serial
             number pairing.
         """
         self.port_name = name
-        self.port = serial.Serial(self.port_name, baudrate=115200)
+        self.port = port if port is not None else serial.Serial(self.port_name, baudrate=115200)
+        self.port.timeout = self.__class__.READ_TIMEOUT
+        self.command_timeout = self.__class__.COMMAND_TIMEOUT
         self.scanned_devices = []
 
+        # Output received since the last command as (time.perf_counter_ns() of arrival, text)
+        # chunks, and how many of the chunks have been returned to a caller.
+        self._received = []
+        self._consumed = 0
+        self._data_ready = threading.Condition()
+        # Set while the reader thread holds output it has read but not yet stored.
+        self._receiving = False
+
+        # The received chunks of the last scan window, kept as the list command clears them.
+        self._scan_output = []
+
+        self.command_sent_ns = None
+        self.scan_started_ns = None
+        self.connect_sent_ns = None
+        self.connect_complete_ns = None
+
+        self._reading = threading.Event()
+        self._reading.set()
+        self._reader = threading.Thread(target=self._read_port, daemon=True)
+        self._reader.start()
+
 
     def shutdown(self):
         """ Shutdown the monitor. """
         self.disable()
+        self._reading.clear()
+        self._reader.join()
+
+
+    def _read_port(self):
+        """ Reader thread: block on the port and timestamp output as it arrives.
+
+        This is the only thread reading the port.
+        """
+        while self._reading.is_set():
+            data = self.port.read(1)
+            if not data:
+                continue
+            self._receiving = True
+            arrival_ns = time.perf_counter_ns()
+            data += self.port.read(self.port.in_waiting)
+
+            with self._data_ready:
+                # Output that arrived before the current command was written is stale.
+                if self.command_sent_ns is None or arrival_ns >= self.command_sent_ns:
+                    # Serial noise must not kill the reader thread.
+                    self._received.append((arrival_ns, data.decode('ascii', 'replace')))
+                self._receiving = False
+                self._data_ready.notify_all()
+
+
+    def _catch_up(self):
+        """ Wait (briefly) until the reader thread has stored all output already on the port. """
+        with self._data_ready:
+            self._data_ready.wait_for(lambda: not self._receiving and not self.port.in_waiting,
+                                      self.__class__.READ_TIMEOUT)
+
+
+    def _take_response(self):
+        """ Return the received output not yet returned to a caller. """
+        with self._data_ready:
+            response = ''.join(text for (_, text) in self._received[self._consumed:])
+            self._consumed = len(self._received)
+        return response
+
+
+    def arrival_ns(self, text):
+        """ Find when a piece of output arrived.
+
+        Args:
+            text: The output to look for in what was received since the last command.
+
+        Returns:
+            The time.perf_counter_ns() at which the text was completely received, or None.
+        """
+        with self._data_ready:
+            return self._find_arrival(self._received, text)
+
+
+    @staticmethod
+    def _find_arrival(chunks, text):
+        """ The arrival time of the chunk completing the first occurrence of text, or None. """
+        received = ''
+        for (timestamp, chunk) in chunks:
+            received += chunk
+            if text in received:
+                return timestamp
+        return None
 
 
     def reset(self):
@@ -70,24 +171,33 @@ class SentivaMonitor():
         """ The monitor is always enabled. """
 
 
-    def _execute_command(self, command, arg=None, timeout=0.5):
+    def _execute_command(self, command, arg=None, timeout=None):
         """ Execute a command on the monitor.
 
         Args:
             command: The command to execute.
             arg: An optional argument to provide to the command to execute.
-            timeout: The duration to wait for the command to complete in seconds.
+            timeout: The duration to wait for the command to complete in seconds. Defaults to
+                the monitor's command timeout.
 
         Returns:
             The text output of the command.
         """
+        if timeout is None:
+            timeout = self.command_timeout
+
         command_string = '{}({})\r\n'.format(command, arg if arg else '')
 
-        self.port.reset_input_buffer()
-        self.port.write(command_string.encode('ascii'))
+        with self._data_ready:
+            self.port.reset_input_buffer()
+            self._received = []
+            self._consumed = 0
+            self.command_sent_ns = time.perf_counter_ns()
+            self.port.write(command_string.encode('ascii'))
         time.sleep(timeout)
 
-        return self.port.read(self.port.inWaiting()).decode('ascii')
+        self._catch_up()
+        return self._take_response()
 
     def _poll_for_response(self, interval, num_checks):
         """ Poll the monitor for a response. Some commands have a non-deterministic and long response time
@@ -97,11 +207,11 @@ class SentivaMonitor():
             num_checks: The number of times to check
         """
         for _ in range(num_checks):
-            resp = self.port.read(self.port.inWaiting()).decode('ascii')
+            with self._data_ready:
+                self._data_ready.wait_for(lambda: self._consumed < len(self._received), interval)
+            resp = self._take_response()
             if resp:
                 return resp
-            else:
-                time.sleep(interval)
         return ""
 
     def ble_connect(self, name, timeout=80):
@@ -123,15 +233,22 @@ class SentivaMonitor():
                 device_index = device.index
 
         if not device_index:
-            raise DevKitConnectionException('Attempting to connect to a device that was not scanned.',-1)
+            raise DevKitConnectionException('Attempting to connect to a device that was not scanned.',DEVICE_NOT_SCANNED)
 
-        self._execute_command('connect', device_index)
+        self.connect_sent_ns = None
+        self.connect_complete_ns = None
+        resp = self._execute_command('connect', device_index)
+        self.connect_sent_ns = self.command_sent_ns
         
-        #The SDK returns "Connection complete"
-        resp = self._poll_for_response(1, timeout)
+        #The SDK returns "Connection complete", possibly already within the command timeout and
+        #possibly split over several chunks, so collect output until it is complete.
+        deadline = time.perf_counter() + timeout
+        while "complete" not in resp and time.perf_counter() < deadline:
+            resp += self._poll_for_response(min(1, max(0, deadline - time.perf_counter())), 1)
         if "complete" not in resp:
             #Raise the exception that the expected device wasn't found
-            raise DevKitConnectionException("Could not Connect over BLE")
+            raise DevKitConnectionException("Could not Connect over BLE",CONNECT_FAILED)
+        self.connect_complete_ns = self.arrival_ns("complete")
 
     def ble_scan(self, duration):
         """ Scan for BLE peripheral devices.
@@ -144,9 +261,13 @@ class SentivaMonitor():
         """
         self.scanned_devices.clear()
         self._execute_command('scan')
+        self.scan_started_ns = self.command_sent_ns
 
         time.sleep(duration)
 
+        self._catch_up()
+        with self._data_ready:
+            self._scan_output = list(self._received)
         output = self._execute_command('list')
 
         if not output:
@@ -164,6 +285,19 @@ class SentivaMonitor():
         return self.scanned_devices
 
 
+    def device_arrival_ns(self, name):
+        """ The time.perf_counter_ns() at which a device of the last scan was first reported.
+
+        Output naming the device during the scan window is used when there is any. The current
+        dev kit firmware only reports devices in response to the list command, so the device's
+        list entry is used otherwise. That time is after the scan command's timeout, the scan
+        duration and the list command's timeout, so scan latencies measured from it have the
+        resolution of one scan attempt, not of the reader thread's polling.
+        """
+        return (self._find_arrival(self._scan_output, name) or
+                self.arrival_ns('"{}"'.format(name)))
+
+
     def ble_disconnect(self):
         """ Disconnect from a connected BLE device. """
         self._execute_command('disconnect')
@@ -180,8 +314,8 @@ class SentivaMonitor():
 
         #The RSSI takes ?? seconds to happen, set timout to ensure that
         #at least 1 RSSI measurement takes place
-        output = self._execute_command('startRSSI', timeout=2)
-        self._execute_command('stopRSSI', timeout=0.1)
+        output = self._execute_command('startRSSI', timeout=self.RSSI_DURATION)
+        self._execute_command('stopRSSI', timeout=self.STOP_RSSI_TIMEOUT)
 
         rssi = re.search('Rssi is (-?\d+) with conn_handle', output)
         if not rssi:
@@ -201,6 +335,11 @@ class SentivaMonitor():
         res = self._execute_command("cscani",interval)
         res=res+self._execute_command("cscanw",window)
         res = res.split()
-        setInterval = (int)(int(res[6])*0.625)   # the firmware return in unit of 0.625 millisecodns
-        setWindow = (int)(int(res[14])*0.625)
+        try:
+            setInterval = (int)(int(res[6])*0.625)   # the firmware return in unit of 0.625 millisecodns
+            setWindow = (int)(int(res[14])*0.625)
+        except (IndexError, ValueError):
+            # A short or garbled reply, e.g. right after a reboot
+            raise DevKitConnectionException('Unexpected scan parameter response: {}'.format(
+                ' '.join(res)),DEV_KIT_BAD_RESPONSE)
         return [setInterval, setWindow]
\ No newline at end of file
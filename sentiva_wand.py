@@ -61,7 +61,9 @@ FCALL 0 0x115 <on> Controls the BLE radio. Legal values for "on" are 0 - 2.
 
 import os
 import sys
-from exceptions import WandCommException
+from exceptions import (WandCommException, WAND_UNAVAILABLE, WAND_NO_RESPONSE, WAND_COMMAND_FAILED,
+                        WAND_BAD_RESPONSE)
+from version_cache import version_cache
 
 #from autotest.equipment import TestEquipment
 #from autotest.exceptions import AutoTestException
@@ -74,7 +76,7 @@ try:
     from TivaComm import WandComm
 
 except:
-    raise WandCommException("Error loading WandComm DLL",-1)
+    raise WandCommException("Error loading WandComm DLL",WAND_UNAVAILABLE)
     print('Failed to import TivaComm .NET DLL. Please install PythonNet')
     print('SentivaWand driver unavailable.')
 
@@ -97,7 +99,11 @@ class SentivaWand():
 
     def enable(self):
         """ Start communications with the wand. """
-        self.wand.Start().Wait()
+        try:
+            self.wand.Start().Wait()
+        except Exception as e:
+            # .NET exceptions raised through pythonnet
+            raise WandCommException('Failed to start WandComm: {}'.format(e),WAND_COMMAND_FAILED)
         self._execute_command('attention')
         self._execute_command('establish')
         self._execute_command('boot')
@@ -112,9 +118,12 @@ class SentivaWand():
         #return resembles -> Model = 10,  Therapy version = 2.0.0.139
         ret = self._execute_command('v')
         if (len(ret)) == 0:  # if ipg reports no version info, then it must be that Wandcomm is not connected to IPG
-            raise WandCommException()
+            raise WandCommException("IPG returned no version",WAND_NO_RESPONSE)
         
-        (model, version) = ret.split(',')
+        try:
+            (model, version) = ret.split(',')
+        except ValueError:
+            raise WandCommException('Unexpected IPG version response: {}'.format(ret),WAND_BAD_RESPONSE)
         return (model.strip(), version.strip())
 
 
@@ -131,16 +140,21 @@ class SentivaWand():
 
 
     def reset(self):
-        """ There is no way to reset the wand. """
+        """ There is no way to reset the wand. Forgets the cached implant versions. """
         if self.is_enabled():
             self.disable_device_bluetooth()
         self.disable()
+        version_cache.invalidate()
 
 
     def _execute_command(self, command):
-        response = self.wand.Send(command).Result
+        try:
+            response = self.wand.Send(command).Result
+        except Exception as e:
+            # .NET exceptions raised through pythonnet
+            raise WandCommException('WandComm failed to send {}: {}'.format(command, e),WAND_COMMAND_FAILED)
         if 'Failed' in response:
-            raise WandCommException('Failed to run command {} (Response: {})'.format(command, response),-1)
+            raise WandCommException('Failed to run command {} (Response: {})'.format(command, response),WAND_COMMAND_FAILED)
         # TODO: Examine responses and determine what to do with them.
         return response
 
@@ -0,0 +1,338 @@
+"""
+Description: Simulated implant monitor and wand drivers.
+
+The simulated drivers implement the same methods as SentivaMonitor and SentivaWand without any
+hardware, pyserial, recordclass or .NET dependencies so the connectivity test can run in CI, in
+soak tests and in benchmarks. Radio behaviour is driven by a seeded random generator and no
+time is spent sleeping unless a time scale is given.
+"""
+
+import collections
+import random
+import threading
+import time
+
+from exceptions import (DevKitConnectionException, WandCommException, DEVICE_NOT_SCANNED,
+                        CONNECT_FAILED, WAND_COMMAND_FAILED, WAND_BAD_RESPONSE)
+from version_cache import version_cache
+
+
+class SimulatedMonitor():
+    """ Stand-in for the Nordic dev kit driver. """
+
+    ScannedDevice = collections.namedtuple('ScannedDevice', ['name', 'identifier', 'index'])
+
+    def __init__(self, name, serial_number=None, device_filter=None, device_names=None,
+                 detect_probability=0.9, connect_failure_probability=0.02, time_scale=0.0,
+                 seed=0):
+        """ Initialize a simulated monitor.
+
+        Args:
+            name: The name of the equipment (the COM port for the real driver).
+            serial_number: Unused, accepted for compatibility with SentivaMonitor.
+            device_filter: Unused, accepted for compatibility with SentivaMonitor.
+            device_names: The advertising devices in range. Defaults to the expected implant
+                and a few unrelated devices.
+            detect_probability: The probability a device is seen in a single scan.
+            connect_failure_probability: The probability a connect attempt fails.
+            time_scale: Multiplier applied to the real driver's sleeps. 0 never sleeps.
+            seed: Seed of the random generator driving the simulation.
+        """
+        self.port_name = name
+        self.device_names = device_names or ['IPG_EA271A', 'Phone', 'Headset', 'IPG_000000']
+        self.detect_probability = detect_probability
+        self.connect_failure_probability = connect_failure_probability
+        self.time_scale = time_scale
+        self.random = random.Random(seed)
+        self.scanned_devices = []
+        self.connected = None
+        self.scan_params = [0, 0]
+
+        self.command_sent_ns = None
+        self.scan_started_ns = None
+        self.connect_sent_ns = None
+        self.connect_complete_ns = None
+        self._list_arrival_ns = None
+
+
+    def _sleep(self, duration):
+        if self.time_scale:
+            time.sleep(duration * self.time_scale)
+
+
+    def shutdown(self):
+        """ Shutdown the monitor. """
+
+
+    def reset(self):
+        """ Reset the monitor. """
+        self.ble_disconnect()
+        self._execute_command('reboot')
+
+
+    def is_enabled(self):
+        """ The monitor is always enabled. """
+        return True
+
+
+    def disable(self):
+        """ The monitor is always enabled. """
+
+
+    def enable(self):
+        """ The monitor is always enabled. """
+
+
+    def _execute_command(self, command, arg=None, timeout=0.5):
+        """ Pretend to execute a command on the monitor. """
+        self.command_sent_ns = time.perf_counter_ns()
+        self._sleep(timeout)
+        return ''
+
+
+    def ble_connect(self, name, timeout=80):
+        """ Connect to a previously scanned device. """
+        self.connect_sent_ns = None
+        self.connect_complete_ns = None
+        if name not in [device.name for device in self.scanned_devices]:
+            raise DevKitConnectionException('Attempting to connect to a device that was not scanned.',DEVICE_NOT_SCANNED)
+
+        self._execute_command('connect', timeout=0)
+        self.connect_sent_ns = self.command_sent_ns
+        self._sleep(self.random.random())
+        if self.random.random() < self.connect_failure_probability:
+            raise DevKitConnectionException("Could not Connect over BLE",CONNECT_FAILED)
+        self.connected = name
+        self.connect_complete_ns = time.perf_counter_ns()
+
+
+    def ble_scan(self, duration):
+        """ Scan for BLE peripheral devices.
+
+        Returns:
+            A list of ScannedDevice objects.
+        """
+        self.scanned_devices.clear()
+        self._execute_command('scan', timeout=0)
+        self.scan_started_ns = self.command_sent_ns
+        self._sleep(duration)
+        self._list_arrival_ns = time.perf_counter_ns()
+
+        for index, name in enumerate(self.device_names):
+            if self.random.random() < self.detect_probability:
+                self.scanned_devices.append(self.__class__.ScannedDevice(
+                    name=name, identifier='C0FFEE{:06X}'.format(index + 1),
+                    index=str(index + 1)))
+
+        return self.scanned_devices
+
+
+    def device_arrival_ns(self, name):
+        """ The time.perf_counter_ns() at which a device's entry of the last scan list arrived. """
+        if name in [device.name for device in self.scanned_devices]:
+            return self._list_arrival_ns
+        return None
+
+
+    def ble_disconnect(self):
+        """ Disconnect from a connected BLE device. """
+        self.connected = None
+
+
+    def ble_rssi(self):
+        """ Get the RSSI of the simulated connection in dBm. """
+        if self.connected is None:
+            raise Exception('No RSSI detected. Is the device connected?')
+
+        self._sleep(2.1)
+        return int(self.random.gauss(-65, 4))
+
+
+    def setScanParams(self, interval, window):
+        """ Set the scan parameters, rounded to the dev kit's 0.625 ms units. """
+        self.scan_params = [int(int(interval / 0.625) * 0.625), int(int(window / 0.625) * 0.625)]
+        return list(self.scan_params)
+
+
+class SimulatedWand():
+    """ Stand-in for the TivaComm wand driver. """
+
+    RESPONSES = {
+        'v': 'Model = 10,  Therapy version = 2.0.0.139',
+        'readx 13 4 2': '0x0004 0x0002',
+    }
+
+    def __init__(self, failure_probability=0.0, seed=0):
+        """ Initialize a simulated wand.
+
+        Args:
+            failure_probability: The probability any command fails with a WandCommException.
+            seed: Seed of the random generator driving the simulation.
+        """
+        self.failure_probability = failure_probability
+        self.random = random.Random(seed)
+        self.connection_established = False
+        self.bluetooth_enabled = False
+
+
+    def shutdown(self):
+        """ Shutdown communications to the wand. """
+        self.connection_established = False
+
+
+    def enable(self):
+        """ Start communications with the wand. """
+        self.connection_established = True
+
+
+    def get_ipg_version(self):
+        """ Query the IPG for model & version info. """
+        response = self._execute_command('v')
+        try:
+            (model, version) = response.split(',')
+        except ValueError:
+            raise WandCommException('Unexpected IPG version response: {}'.format(response),
+                                    WAND_BAD_RESPONSE)
+        return (model.strip(), version.strip())
+
+
+    def disable(self):
+        """ Stop communications with the wand. """
+        self.connection_established = False
+
+
+    def is_enabled(self):
+        """ Determine if the wand communication channel is enabled. """
+        return self.connection_established
+
+
+    def reset(self):
+        """ There is no way to reset the wand. Forgets the cached implant versions. """
+        if self.is_enabled():
+            self.disable_device_bluetooth()
+        self.disable()
+        version_cache.invalidate()
+
+
+    def _execute_command(self, command):
+        if self.random.random() < self.failure_probability:
+            raise WandCommException('Failed to run command {} (Response: Failed)'.format(command),WAND_COMMAND_FAILED)
+        return self.__class__.RESPONSES.get(command, 'OK')
+
+
+    def disable_device_bluetooth(self):
+        """ Disable bluetooth on the implant device. """
+        self._execute_command('fcall 0 0x115 0')
+        self.bluetooth_enabled = False
+
+
+    def enable_device_bluetooth(self, advertising_interval):
+        """ Enable bluetooth on the implant device. """
+        assert advertising_interval < 16 #Valid range is 0-15
+
+        self._execute_command('fcall 0 0x115 2')
+        self.bluetooth_enabled = True
+
+
+class SimulatedSerialPort():
+    """ A pyserial compatible port that answers like the Nordic dev kit firmware.
+
+    Lets the real SentivaMonitor driver run without hardware. Each command's response is split
+    into chunks; the first is available as soon as the command is written and each later chunk
+    becomes available chunk_interval seconds after the previous one has been read, like a
+    response arriving over time. The connect response arrives split mid-line.
+    """
+
+    def __init__(self, device_names=None, rssi=-60, chunk_interval=0.0):
+        """ Initialize the port.
+
+        Args:
+            device_names: The devices listed after a scan.
+            rssi: The RSSI reported for a connection, in dBm.
+            chunk_interval: The seconds between a chunk being read and the next becoming available.
+        """
+        self.device_names = device_names or ['IPG_EA271A']
+        self.rssi = rssi
+        self.chunk_interval = chunk_interval
+        self.timeout = None
+        self._buffer = b''
+        self._pending = []
+        self._due = 0.0
+        self._ready = threading.Condition()
+
+
+    def _respond(self, command, arg):
+        if command == 'list':
+            return [''.join('[{}]:: C0FFEE{:06X}  "{}" rssi -60\r\n'.format(index + 1, index + 1, name)
+                            for index, name in enumerate(self.device_names))]
+        if command == 'cscani':
+            return ['Scan interval set to value of {} units\r\n'.format(int(int(arg) / 0.625))]
+        if command == 'cscanw':
+            return ['Scan window set to value of {} units\r\n'.format(int(int(arg) / 0.625))]
+        if command == 'connect':
+            return ['Connecting to device {}\r\n'.format(arg), 'Connection ', 'complete\r\n']
+        if command == 'startRSSI':
+            return ['Rssi is {} with conn_handle 0\r\n'.format(self.rssi)]
+        return ['{} OK\r\n'.format(command)]
+
+
+    def write(self, data):
+        (command, _, arg) = data.decode('ascii').strip().rstrip(')').partition('(')
+        chunks = self._respond(command, arg)
+        with self._ready:
+            self._buffer += chunks[0].encode('ascii')
+            self._pending.extend(chunk.encode('ascii') for chunk in chunks[1:])
+            self._ready.notify_all()
+        return len(data)
+
+
+    def inWaiting(self):
+        with self._ready:
+            if not self._buffer and self._pending and time.perf_counter() >= self._due:
+                self._buffer = self._pending.pop(0)
+            return len(self._buffer)
+
+
+    @property
+    def in_waiting(self):
+        return self.inWaiting()
+
+
+    def read(self, size=1):
+        """ Read up to size bytes, blocking until data is available or the timeout passes. """
+        deadline = None if self.timeout is None else time.perf_counter() + self.timeout
+        with self._ready:
+            while not self.inWaiting():
+                wait = None if deadline is None else deadline - time.perf_counter()
+                if wait is not None and wait <= 0:
+                    return b''
+                if self._pending:
+                    due = max(0.0, self._due - time.perf_counter())
+                    wait = due if wait is None else min(wait, due)
+                self._ready.wait(wait)
+
+            (data, self._buffer) = (self._buffer[:size], self._buffer[size:])
+            if not self._buffer:
+                self._due = time.perf_counter() + self.chunk_interval
+            return data
+
+
+    def reset_input_buffer(self):
+        with self._ready:
+            self._buffer = b''
+            self._pending = []
+
+
+    def close(self):
+        self.reset_input_buffer()
+
+
+def simulated_port_monitor(name, serial_number=None, device_filter=None):
+    """ The real SentivaMonitor driver on a SimulatedSerialPort.
+
+    Exercises the driver's parsing and reader thread without hardware. Imports pyserial and
+    recordclass through the driver.
+    """
+    from sentiva_monitor import SentivaMonitor
+
+    return SentivaMonitor(name, serial_number, device_filter, port=SimulatedSerialPort())
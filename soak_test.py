@@ -0,0 +1,309 @@
+#!/usr/bin/python3
+"""
+Description: Soak test harness for the bluetooth connectivity test.
+
+Runs test cycles the way the runner's loop does, recovering from failures through the test's
+recovery policy, for many iterations (against the simulated drivers by default so it can run in
+CI, or with --real-monitor the real dev kit driver on a simulated serial port) and reports throughput in cycles/hour, per-phase timing against budgets, and
+memory usage. Process RSS and tracemalloc snapshots are sampled at intervals; a steady memory
+growth across enough samples after the warmup is flagged as a regression and makes the run fail.
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+from bluetooth_rf_connectivity_test import BluetoothConnectivityTest
+from plugin_registry import registry, PluginRegistry
+from run_bluetooth_rf_connectivity_test import run_cycle
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def current_rss():
+    """ The resident set size of this process in bytes, or None when it cannot be determined. """
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+
+    if resource is not None:
+        # Peak rather than current RSS, in kB on Linux.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return None
+
+
+def growth_per_iteration(samples):
+    """ Least squares slope of (iteration, value) samples.
+
+    Returns:
+        The growth in value per iteration, 0 with fewer than two samples.
+    """
+    if len(samples) < 2:
+        return 0.0
+
+    n = len(samples)
+    mean_x = sum(x for (x, _) in samples) / n
+    mean_y = sum(y for (_, y) in samples) / n
+    var_x = sum((x - mean_x) ** 2 for (x, _) in samples)
+    if not var_x:
+        return 0.0
+    return sum((x - mean_x) * (y - mean_y) for (x, y) in samples) / var_x
+
+
+class SoakMonitor():
+    """ Collect throughput, phase timing and memory statistics over a soak run. """
+
+    # Expected upper bound of each test iteration phase, in seconds, with real hardware.
+    DEFAULT_PHASE_BUDGETS = {
+        'wand_query': 5.0,
+        'monitor_setup': 3.0,
+        'scan': 60.0,
+        'connect': 30.0,
+        'rssi': 25.0,
+        'record': 0.5,
+        'disconnect': 1.0,
+    }
+
+    def __init__(self, phase_budgets=None, sample_every=100, warmup_samples=2, min_growth_samples=5,
+                 top_allocators=10, rss_growth_limit=1024 * 1024, traced_growth_limit=256 * 1024):
+        """ Initialize the monitor.
+
+        Args:
+            phase_budgets: Phase name to time budget in seconds.
+            sample_every: The number of iterations between memory samples.
+            warmup_samples: Memory samples ignored while caches and pools fill up.
+            min_growth_samples: Memory samples after the warmup needed before growth is flagged.
+            top_allocators: The number of tracemalloc allocation sites reported.
+            rss_growth_limit: Allowed RSS growth in bytes per 1000 iterations.
+            traced_growth_limit: Allowed tracemalloc growth in bytes per 1000 iterations.
+        """
+        self.phase_budgets = dict(phase_budgets or self.__class__.DEFAULT_PHASE_BUDGETS)
+        self.sample_every = sample_every
+        self.warmup_samples = warmup_samples
+        self.min_growth_samples = min_growth_samples
+        self.top_allocators = top_allocators
+        self.rss_growth_limit = rss_growth_limit
+        self.traced_growth_limit = traced_growth_limit
+
+        self.iterations = 0
+        self.failures = 0
+        self.phases = {}
+        self.rss_samples = []
+        self.traced_samples = []
+        self.allocators = []
+        self._baseline = None
+        self._start_time = None
+
+
+    def start(self):
+        """ Start timing and memory tracing. """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        self._start_time = time.perf_counter()
+        self.sample()
+
+
+    def stop(self):
+        """ Take a final memory sample and stop memory tracing. """
+        if self.iterations % self.sample_every:
+            self.sample()
+        tracemalloc.stop()
+
+
+    def on_phase(self, name, seconds):
+        """ Phase listener for BluetoothConnectivityTest. """
+        stats = self.phases.setdefault(name, {'count': 0, 'total': 0.0, 'max': 0.0,
+                                              'over_budget': 0})
+        stats['count'] += 1
+        stats['total'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        if seconds > self.phase_budgets.get(name, float('inf')):
+            stats['over_budget'] += 1
+
+
+    def end_iteration(self, ok):
+        """ Count a finished test iteration and sample memory when due. """
+        self.iterations += 1
+        if not ok:
+            self.failures += 1
+        if self.iterations % self.sample_every == 0:
+            self.sample()
+
+
+    def sample(self):
+        """ Record process RSS, traced memory and the top allocation sites. """
+        rss = current_rss()
+        if rss is not None:
+            self.rss_samples.append((self.iterations, rss))
+
+        (traced, _) = tracemalloc.get_traced_memory()
+        self.traced_samples.append((self.iterations, traced))
+
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        if len(self.traced_samples) <= self.warmup_samples or self._baseline is None:
+            self._baseline = snapshot
+            self.allocators = []
+        else:
+            self.allocators = [str(stat) for stat in
+                               snapshot.compare_to(self._baseline, 'lineno')[:self.top_allocators]]
+
+
+    def report(self):
+        """ Summarise the run.
+
+        Returns:
+            A dict of throughput, phase, memory statistics and detected regressions.
+        """
+        elapsed = time.perf_counter() - self._start_time
+        rss_growth = growth_per_iteration(self.rss_samples[self.warmup_samples:]) * 1000
+        traced_growth = growth_per_iteration(self.traced_samples[self.warmup_samples:]) * 1000
+
+        # A few samples of a short run mostly measure allocator and import noise.
+        enough_samples = len(self.traced_samples) - self.warmup_samples >= self.min_growth_samples
+
+        regressions = []
+        if enough_samples and rss_growth > self.rss_growth_limit:
+            regressions.append('RSS grows {:.0f} bytes per 1000 iterations'.format(rss_growth))
+        if enough_samples and traced_growth > self.traced_growth_limit:
+            regressions.append('Traced memory grows {:.0f} bytes per 1000 iterations'.format(
+                traced_growth))
+        for name, stats in sorted(self.phases.items()):
+            if stats['over_budget']:
+                regressions.append('Phase {} over its {} s budget {} times'.format(
+                    name, self.phase_budgets[name], stats['over_budget']))
+
+        return {
+            'iterations': self.iterations,
+            'failures': self.failures,
+            'elapsed_seconds': elapsed,
+            'cycles_per_hour': self.iterations / elapsed * 3600 if elapsed else 0.0,
+            'phases': {name: dict(stats, mean=stats['total'] / stats['count'],
+                                  budget=self.phase_budgets.get(name))
+                       for name, stats in self.phases.items()},
+            'rss_bytes': self.rss_samples[-1][1] if self.rss_samples else None,
+            'rss_growth_per_1000_iterations': rss_growth,
+            'traced_growth_per_1000_iterations': traced_growth,
+            'memory_samples': len(self.traced_samples),
+            'growth_checked': enough_samples,
+            'top_allocators': self.allocators,
+            'regressions': regressions,
+        }
+
+
+def run_soak(test, monitor, iterations=None, duration=None, verbose=False):
+    """ Run test cycles like the runner's loop until the iteration count or duration is reached.
+
+    Failures are recovered through the test's recovery policy; reflashing is skipped.
+
+    Args:
+        test: The BluetoothConnectivityTest to exercise.
+        monitor: The SoakMonitor collecting statistics.
+        iterations: Stop after this many iterations, if given.
+        duration: Stop after this many seconds, if given.
+        verbose: Keep the test's console output.
+    """
+    test.phase_listener = monitor.on_phase
+    monitor.start()
+    deadline = time.perf_counter() + duration if duration else None
+
+    with open(os.devnull, 'w') as devnull:
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(devnull)
+        with output:
+            while True:
+                if iterations is not None and monitor.iterations >= iterations:
+                    break
+                if deadline is not None and time.perf_counter() >= deadline:
+                    break
+
+                (ok, _) = run_cycle(test, '0', '0', '')
+                monitor.end_iteration(ok)
+
+    monitor.stop()
+    return monitor.report()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Soak test the bluetooth connectivity test loop')
+    parser.add_argument('--iterations', type=int, default=2000, help='Iterations to run')
+    parser.add_argument('--duration', type=float, help='Seconds to run, instead of iterations')
+    parser.add_argument('--sample-every', type=int, default=100,
+                        help='Iterations between memory samples')
+    parser.add_argument('--hardware', action='store_true',
+                        help='Use the real wand and dev kit instead of the simulated drivers')
+    parser.add_argument('--real-monitor', action='store_true',
+                        help='Run the real dev kit driver on a simulated serial port, so its '
+                             'parsing and reader thread are covered')
+    parser.add_argument('--log', default=os.devnull, help='CSV file the measurements go to')
+    parser.add_argument('--report', help='Write the report as JSON to this file')
+    parser.add_argument('--verbose', action='store_true', help='Show the test output')
+    args = parser.parse_args(argv)
+
+    sinks = [registry.create(PluginRegistry.SINK, 'csv', args.log)]
+    if args.hardware:
+        test = BluetoothConnectivityTest(sinks=sinks)
+    else:
+        monitor_driver = 'simulated_port_monitor' if args.real_monitor else 'simulated_monitor'
+        test = BluetoothConnectivityTest(monitor_driver=monitor_driver,
+                                         wand_driver='simulated_wand', sinks=sinks)
+        if args.real_monitor:
+            # The simulated port answers at once, so the driver's waits are not needed.
+            test.implant_monitor.command_timeout = 0
+            test.implant_monitor.RSSI_DURATION = 0
+            test.implant_monitor.STOP_RSSI_TIMEOUT = 0
+            test.SCAN_DURATION = 0
+        test.SETTLE_DURATION = 0
+        test.JITTER_SCALE = 0
+        test.recovery_policy.backoff_delay = 0
+        # One repetition per cycle, without a sweep checkpoint.
+        test.SWEEP_MIN_REPETITIONS = test.SWEEP_MAX_REPETITIONS = 1
+        test.sweep_checkpoint = None
+
+    monitor = SoakMonitor(sample_every=args.sample_every)
+    report = run_soak(test, monitor, iterations=None if args.duration else args.iterations,
+                      duration=args.duration, verbose=args.verbose)
+
+    print('{} iterations ({} failed) in {:.1f} s: {:.0f} cycles/hour'.format(
+        report['iterations'], report['failures'], report['elapsed_seconds'],
+        report['cycles_per_hour']))
+    for name, stats in sorted(report['phases'].items()):
+        print('  {:<14} mean {:8.3f} ms  max {:8.3f} ms  over budget {}'.format(
+            name, stats['mean'] * 1e3, stats['max'] * 1e3, stats['over_budget']))
+    print('RSS growth: {:.0f} B/1000 iterations, traced growth: {:.0f} B/1000 iterations'.format(
+        report['rss_growth_per_1000_iterations'], report['traced_growth_per_1000_iterations']))
+    if not report['growth_checked']:
+        print('Memory growth not checked: {} memory samples is too few'.format(
+            report['memory_samples']))
+    for allocator in report['top_allocators']:
+        print('  ' + allocator)
+    for regression in report['regressions']:
+        print('REGRESSION: ' + regression)
+
+    if args.report:
+        with open(args.report, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+
+    return 1 if report['regressions'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""
+Description: Sequential parameter sweep with confidence interval based early stopping.
+
+Instead of running a fixed number of repetitions of every parameter combination, the sweep
+evaluates after each repetition a Wilson score interval on the combination's success rate and a
+normal interval on its mean latency. A combination stops once both intervals are narrower than
+the target precision (or it reaches the maximum number of repetitions), and every next
+repetition goes to the unfinished combination whose intervals are widest relative to their
+targets. The sweep state is checkpointed to a JSON file after each repetition so an interrupted
+sweep resumes where it stopped.
+
+Running this module checks the sweep on scripted outcomes.
+"""
+
+import json
+import math
+import os
+import statistics
+import sys
+import tempfile
+
+
+class CombinationStats():
+    """ Running statistics of one parameter combination. """
+
+    def __init__(self, repetitions=0, successes=0, latency_count=0, latency_sum=0.0,
+                 latency_sum_squares=0.0):
+        self.repetitions = repetitions
+        self.successes = successes
+        self.latency_count = latency_count
+        self.latency_sum = latency_sum
+        self.latency_sum_squares = latency_sum_squares
+
+
+    def add(self, success, latency=None):
+        """ Add the outcome of one repetition.
+
+        Args:
+            success: Whether the repetition succeeded.
+            latency: The latency measured in seconds, or None when there is none.
+        """
+        self.repetitions += 1
+        if success:
+            self.successes += 1
+        if latency is not None and latency >= 0:
+            self.latency_count += 1
+            self.latency_sum += latency
+            self.latency_sum_squares += latency * latency
+
+
+    def success_interval(self, z):
+        """ The Wilson score interval of the success rate as (low, high). """
+        if not self.repetitions:
+            return (0.0, 1.0)
+
+        n = self.repetitions
+        p = self.successes / n
+        centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+        half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+        return (max(0.0, centre - half_width), min(1.0, centre + half_width))
+
+
+    def latency_mean(self):
+        """ The mean latency in seconds, or None without latencies. """
+        if not self.latency_count:
+            return None
+        return self.latency_sum / self.latency_count
+
+
+    def latency_half_width(self, z):
+        """ The half width of the normal interval of the mean latency, infinite below 2 samples. """
+        if self.latency_count < 2:
+            return math.inf
+
+        n = self.latency_count
+        variance = max(0.0, (self.latency_sum_squares - self.latency_sum ** 2 / n) / (n - 1))
+        return z * math.sqrt(variance / n)
+
+
+class SequentialSweep():
+    """ Allocate repetitions over parameter combinations until each is measured precisely enough. """
+
+    def __init__(self, combinations, min_repetitions=3, max_repetitions=20,
+                 success_half_width=0.15, latency_relative_half_width=0.2, confidence=0.95,
+                 checkpoint_path=None, label=''):
+        """ Initialize the sweep.
+
+        Args:
+            combinations: The parameter combinations, as tuples.
+            min_repetitions: Repetitions every combination gets before it can stop.
+            max_repetitions: Repetitions after which a combination stops regardless.
+            success_half_width: The target half width of the success rate interval.
+            latency_relative_half_width: The target half width of the mean latency interval,
+                relative to the mean.
+            confidence: The confidence level of the intervals.
+            checkpoint_path: A JSON file the sweep state is saved to and resumed from.
+            label: Identifies the sweep (e.g. the firmware build). A checkpoint with another
+                label or other combinations is ignored.
+        """
+        self.combinations = [tuple(combination) for combination in combinations]
+        self.min_repetitions = min_repetitions
+        self.max_repetitions = max_repetitions
+        self.success_half_width = success_half_width
+        self.latency_relative_half_width = latency_relative_half_width
+        self.z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.checkpoint_path = checkpoint_path
+        self.label = label
+
+        self.stats = {combination: CombinationStats() for combination in self.combinations}
+        self._load()
+
+
+    def _key(self, combination):
+        return ':'.join(str(value) for value in combination)
+
+
+    def _load(self):
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return
+
+        with open(self.checkpoint_path) as checkpoint_file:
+            checkpoint = json.load(checkpoint_file)
+
+        keys = {self._key(combination): combination for combination in self.combinations}
+        if checkpoint.get('label') != self.label or set(checkpoint['stats']) != set(keys):
+            return
+
+        for key, values in checkpoint['stats'].items():
+            self.stats[keys[key]] = CombinationStats(**values)
+
+
+    def save(self):
+        """ Write the sweep state to the checkpoint file. """
+        if not self.checkpoint_path:
+            return
+
+        checkpoint = {'label': self.label,
+                      'stats': {self._key(combination): vars(stats)
+                                for combination, stats in self.stats.items()}}
+        with open(self.checkpoint_path + '.tmp', 'w') as checkpoint_file:
+            json.dump(checkpoint, checkpoint_file, indent=2)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+
+    def clear_checkpoint(self):
+        """ Remove the checkpoint file, e.g. once the sweep is complete. """
+        if self.checkpoint_path and os.path.exists(self.checkpoint_path):
+            os.remove(self.checkpoint_path)
+
+
+    def uncertainty(self, combination):
+        """ How far a combination is from the target precision. 1 or less means precise enough.
+
+        Only the success rate interval counts while the combination has no latencies (e.g. all
+        repetitions failed).
+        """
+        stats = self.stats[combination]
+        (low, high) = stats.success_interval(self.z)
+        uncertainty = (high - low) / 2 / self.success_half_width
+
+        mean = stats.latency_mean()
+        if mean:
+            uncertainty = max(uncertainty, stats.latency_half_width(self.z) /
+                              (self.latency_relative_half_width * mean))
+        return uncertainty
+
+
+    def is_done(self, combination):
+        """ Determine if a combination needs no more repetitions. """
+        repetitions = self.stats[combination].repetitions
+        if repetitions >= self.max_repetitions:
+            return True
+        return repetitions >= self.min_repetitions and self.uncertainty(combination) <= 1
+
+
+    def next_combination(self):
+        """ The combination to run the next repetition of, or None when the sweep is complete.
+
+        Combinations below the minimum repetitions go first, in order. After that the
+        unfinished combination with the highest uncertainty is chosen.
+        """
+        unfinished = [combination for combination in self.combinations
+                      if not self.is_done(combination)]
+        if not unfinished:
+            return None
+
+        for combination in unfinished:
+            if self.stats[combination].repetitions < self.min_repetitions:
+                return combination
+        return max(unfinished, key=self.uncertainty)
+
+
+    def record(self, combination, success, latency=None):
+        """ Record the outcome of a repetition and checkpoint the sweep.
+
+        Args:
+            combination: The combination the repetition ran.
+            success: Whether the repetition succeeded.
+            latency: The latency measured in seconds, or None when there is none.
+        """
+        self.stats[tuple(combination)].add(success, latency)
+        self.save()
+
+
+    def repetitions(self, combination):
+        """ The number of repetitions a combination has had. """
+        return self.stats[tuple(combination)].repetitions
+
+
+
+def _check(condition, description):
+    if not condition:
+        raise AssertionError('sweep_engine self check failed: ' + description)
+
+
+def _repetitions_until_done(latencies):
+    """ Run one combination with the connectivity test's sweep targets on scripted outcomes.
+
+    Args:
+        latencies: The scan latency of each repetition in seconds, None when it failed.
+
+    Returns:
+        The number of repetitions the combination took.
+    """
+    sweep = SequentialSweep([(40, 30, 1)], min_repetitions=2, max_repetitions=10,
+                            success_half_width=0.3, latency_relative_half_width=0.5)
+    latencies = iter(latencies)
+    while sweep.next_combination() is not None:
+        latency = next(latencies)
+        sweep.record((40, 30, 1), latency is not None, latency)
+    return sweep.repetitions((40, 30, 1))
+
+
+def self_check():
+    """ Check the sweep's allocation, stopping and resuming on scripted outcomes. """
+    # Combinations below the minimum repetitions go first, in order.
+    sweep = SequentialSweep([('a',), ('b',), ('c',)], min_repetitions=2)
+    order = []
+    for _ in range(6):
+        combination = sweep.next_combination()
+        order.append(combination[0])
+        sweep.record(combination, True, 1.0)
+    _check(order == ['a', 'a', 'b', 'b', 'c', 'c'], 'minimum repetitions order {}'.format(order))
+
+    # After that the least precise combination is chosen.
+    sweep.record(('b',), False)
+    _check(sweep.next_combination() == ('b',), 'least precise combination first')
+
+    # The repetitions a pass costs with the connectivity test's targets.
+    cases = [('always connects', [1.0] * 10, 3),
+             ('first attempt fails', [None] + [1.0] * 9, 5),
+             ('connects half the time', [1.0, None] * 5, 7),
+             ('scan latency varies widely', [1.0, 4.0] * 5, 8),
+             ('never precise enough', [1.0, None, 4.0] * 4, 10)]
+    for description, latencies, expected in cases:
+        repetitions = _repetitions_until_done(latencies)
+        _check(repetitions == expected, '{}: {} repetitions instead of {}'.format(
+            description, repetitions, expected))
+
+    # An interrupted sweep resumes from its checkpoint, unless the label or combinations differ.
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint_path = os.path.join(directory, 'sweep_checkpoint.json')
+        sweep = SequentialSweep([('a',), ('b',)], checkpoint_path=checkpoint_path, label='1:1.0')
+        for _ in range(3):
+            sweep.record(sweep.next_combination(), True, 1.0)
+
+        resumed = SequentialSweep([('a',), ('b',)], checkpoint_path=checkpoint_path,
+                                  label='1:1.0')
+        _check([resumed.repetitions(c) for c in resumed.combinations] == [3, 0],
+               'resumed repetitions')
+        _check(resumed.next_combination() == ('b',), 'resumed next combination')
+        other_build = SequentialSweep([('a',), ('b',)], checkpoint_path=checkpoint_path,
+                                      label='1:2.0')
+        _check(other_build.repetitions(('a',)) == 0, 'checkpoint of another build ignored')
+        other_combinations = SequentialSweep([('a',)], checkpoint_path=checkpoint_path,
+                                             label='1:1.0')
+        _check(other_combinations.repetitions(('a',)) == 0,
+               'checkpoint of other combinations ignored')
+
+        resumed.clear_checkpoint()
+        _check(not os.path.exists(checkpoint_path), 'checkpoint cleared')
+
+    print('sweep_engine self check passed')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(self_check())
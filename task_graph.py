@@ -0,0 +1,88 @@
+"""
+Description: A small dependency graph of tasks run on a thread pool.
+
+Used to overlap independent steps of a test iteration, e.g. wand queries over the inductive link
+and the dev kit reboot over its serial port. A task starts as soon as every task it depends on
+has finished; steps on the same physical link are kept in order by declaring them as
+dependencies (or by running them inside one task).
+"""
+
+import concurrent.futures
+import time
+
+
+class TaskGraph():
+    """ Run named tasks concurrently, respecting their declared dependencies. """
+
+    def __init__(self):
+        self._tasks = {}
+
+
+    def add(self, name, function, depends=()):
+        """ Add a task to the graph.
+
+        Args:
+            name: The unique name of the task.
+            function: Called with no arguments to run the task. Its return value is the result.
+            depends: The names of tasks that must finish before this task starts.
+        """
+        if name in self._tasks:
+            raise ValueError('Task {} already added'.format(name))
+        for dependency in depends:
+            if dependency not in self._tasks:
+                raise ValueError('Task {} depends on unknown task {}'.format(name, dependency))
+
+        self._tasks[name] = (function, tuple(depends))
+
+
+    def run(self, listener=None):
+        """ Run every task and wait for them to finish.
+
+        When a task fails, tasks depending on it are not started, tasks already running are
+        waited for, and the exception of the first failed task (in the order tasks were added) is
+        raised.
+
+        Args:
+            listener: Called with (task name, seconds) as each task finishes successfully.
+
+        Returns:
+            A dict of task name to the task's return value.
+        """
+        results = {}
+        errors = {}
+        pending = dict(self._tasks)
+        running = {}
+
+        def timed(function):
+            start = time.perf_counter()
+            return (function(), time.perf_counter() - start)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(pending))) as pool:
+            while pending or running:
+                for name, (function, depends) in list(pending.items()):
+                    if any(dependency in errors for dependency in depends):
+                        del pending[name]
+                    elif all(dependency in results for dependency in depends):
+                        del pending[name]
+                        running[pool.submit(timed, function)] = name
+
+                if not running:
+                    break
+
+                (done, _) = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        (results[name], seconds) = future.result()
+                    except Exception as e:
+                        errors[name] = e
+                        continue
+                    if listener is not None:
+                        listener(name, seconds)
+
+        for name in self._tasks:
+            if name in errors:
+                raise errors[name]
+
+        return results
@@ -0,0 +1,20 @@
+"""
+Description: Latency measurement on the monotonic time.perf_counter_ns() clock.
+
+Drivers timestamp commands as they are written and output as it arrives with
+time.perf_counter_ns(), so latencies do not include sleeps, polling or command timeouts.
+"""
+
+import time
+
+
+def elapsed_seconds(start_ns, end_ns=None):
+    """ The seconds from start_ns to end_ns, both time.perf_counter_ns() values.
+
+    Args:
+        start_ns: The start of the interval.
+        end_ns: The end of the interval. Defaults to now.
+    """
+    if end_ns is None:
+        end_ns = time.perf_counter_ns()
+    return (end_ns - start_ns) / 1e9
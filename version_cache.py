@@ -0,0 +1,43 @@
+"""
+Description: Cache of implant version/identity responses keyed by device serial and flashed build.
+
+The implant firmware only changes when a new build is flashed, so version queries over the wand
+only need to be made once per build. The firmware loaders invalidate the cache when they flash,
+and it can be invalidated explicitly when a device is reset.
+"""
+
+import threading
+
+
+class DeviceVersionCache():
+    """ Version responses per (device serial, firmware build). """
+
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+
+    def get(self, serial_number, build):
+        """ The cached versions of a device running a build, or None. """
+        with self._lock:
+            return self._entries.get((serial_number, build))
+
+
+    def put(self, serial_number, build, versions):
+        """ Cache the versions of a device running a build. """
+        with self._lock:
+            self._entries[(serial_number, build)] = versions
+
+
+    def invalidate(self, serial_number=None):
+        """ Forget the cached versions of one device, or of every device when no serial is given. """
+        with self._lock:
+            if serial_number is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == serial_number]:
+                    del self._entries[key]
+
+
+# The cache shared by the test and the firmware loaders.
+version_cache = DeviceVersionCache()